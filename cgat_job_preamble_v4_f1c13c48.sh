@@ -0,0 +1,96 @@
+# cgatcore job preamble, version 4
+
+# create a temporary directory below $1 and export it as TMPDIR
+cgat_setup_tmpdir() {
+    mkdir -p "$1"
+    TMPDIR=$(mktemp -d -p "$1")
+    export TMPDIR
+}
+
+cgat_clean_tmpdir() {
+    rm -rf "$TMPDIR"
+}
+
+# output times whenever the script exits
+cgat_info() {
+    echo 'benchmark'; hostname; times
+}
+
+# restrict virtual memory to $1 kb. Errors are ignored as
+# setting limits is often not permitted.
+cgat_set_memory_limit() {
+    set +e
+    ulimit -v "$1" > /dev/null
+    ulimit -m "$1" > /dev/null
+    ulimit -H -v > /dev/null
+    set -e
+}
+
+# output low-level debugging information for job $1 with
+# script $2 to the shell log file $3
+cgat_log_shell() {
+    mkdir -p "$(dirname "$3")"
+    echo "$1 : START -> $2" >> "$3"
+    set | sed "s/^/$1 : /" >> "$3"
+    pwd | sed "s/^/$1 : /" >> "$3"
+    hostname | sed "s/^/$1: /" >> "$3"
+    if [ -r /proc/meminfo ]; then
+        cat /proc/meminfo | sed "s/^/$1: /" >> "$3"
+    elif command -v vm_stat > /dev/null; then
+        vm_stat | sed "s/^/$1: /" >> "$3"
+    fi
+    echo "$1 : END -> $2" >> "$3"
+    ulimit | sed "s/^/$1: /" >> "$3"
+}
+
+# copy input file $1 to $2 on node-local scratch
+cgat_stage_in() {
+    mkdir -p "$(dirname "$2")"
+    cp "$1" "$2"
+}
+
+# copy output file $1 from node-local scratch to $2, which is
+# only replaced once the copy is complete
+cgat_stage_out() {
+    mkdir -p "$(dirname "$2")"
+    cp "$1" "$2.staging.$$"
+    mv -f "$2.staging.$$" "$2"
+}
+
+# output statement number $3 (1-based) from the statement file $1
+# using the index $2, see write_statement_index()
+cgat_get_statement() {
+    local offset length
+    read -r offset length <<< "$({ tail -c +$(( ($3 - 1) * 42 + 1 )) "$2" || true; } | head -c 42)"
+    { tail -c +$(( offset + 1 )) "$1" || true; } | head -c "$length"
+}
+
+# run statement $3 from statement file $1 with index $2 using the
+# shell options $5 and append a record with its exit status, start
+# and end time and user and system time to $4
+cgat_run_bundle_member() {
+    local start end status=0 statement times_self times_children
+    local times_file="$TMPDIR/cgat_times_$3"
+    statement=$(cgat_get_statement "$1" "$2" "$3")
+    start=$(date +%s)
+    bash $5 -c "$statement" || status=$?
+    end=$(date +%s)
+    # times needs to run in this shell to report the statement
+    times > "$times_file"
+    { read -r times_self; read -r times_children; } < "$times_file"
+    rm -f "$times_file"
+    echo "$3 $status $start $end $times_children" >> "$4"
+}
+
+# run statements $3 to $4 from statement file $1 with index $2,
+# at most $5 at a time, see cgat_run_bundle_member
+cgat_run_bundle() {
+    local task
+    for (( task=$3; task<=$4; task++ )); do
+        while [ "$(jobs -pr | wc -l)" -ge "$5" ]; do
+            wait -n || true
+        done
+        cgat_run_bundle_member "$1" "$2" "$task" "$6" "$7" &
+    done
+    wait
+}
@@ -329,6 +329,7 @@ from cgatcore.pipeline.database import *
 from cgatcore.pipeline.files import *
 from cgatcore.pipeline.cluster import *
 from cgatcore.pipeline.execution import *
+from cgatcore.pipeline.metrics import *
 from cgatcore.pipeline.utils import *
 from cgatcore.pipeline.parameters import *
 
@@ -35,6 +35,18 @@ def get_logger():
 JobInfo = collections.namedtuple("JobInfo", ("jobId", "resourceUsage"))
 
 
+class JobMemoryError(OSError):
+    """raised if a job has been terminated for exceeding its memory.
+
+    The resource usage collected for the job is available as
+    attribute ``resource_usage``.
+    """
+
+    def __init__(self, msg, resource_usage=None):
+        OSError.__init__(self, msg)
+        self.resource_usage = resource_usage or []
+
+
 # Timeouts for event loop
 GEVENT_TIMEOUT_SACCT = 5
 GEVENT_TIMEOUT_WAIT = 1
@@ -46,6 +58,12 @@ class DRMAACluster(object):
     # to a common set of names.
     map_drmaa2benchmark_data = {}
 
+    # environment variable containing the task id within array jobs
+    task_id_variable = "SGE_TASK_ID"
+
+    # size of the unit of max_rss in bytes
+    max_rss_unit = 1024
+
     def __init__(self, session, ignore_errors=False):
         self.session = session
         self.ignore_errors = ignore_errors
@@ -60,16 +78,21 @@ class DRMAACluster(object):
                                  job_memory,
                                  job_threads,
                                  working_directory,
+                                 bash_env="~/.bashrc",
                                  **kwargs):
         '''Sets up a Drmma job template. Currently SGE, SLURM, Torque and PBSPro are
-        supported'''
+        supported.
+
+        *bash_env* is the file sourced by the job shell, either the
+        shell initialisation file or an environment snapshot.
+        '''
         if not job_memory:
             raise ValueError("Job memory must be specified when running"
                              "DRMAA jobs")
 
         jt = drmaa_session.createJobTemplate()
         jt.workingDirectory = working_directory
-        jt.jobEnvironment = {'BASH_ENV': '~/.bashrc'}
+        jt.jobEnvironment = {'BASH_ENV': bash_env}
         jt.args = []
         if not re.match("[a-zA-Z]", job_name[0]):
             job_name = "_" + job_name
@@ -90,15 +113,47 @@ class DRMAACluster(object):
     def update_template(self, jt):
         pass
 
+    def is_memory_error(self, retval, resource_usage, job_memory_bytes=None):
+        """return True if a job has been terminated for exceeding
+        its memory.
+
+        A job is assumed to have run out of memory if it has been
+        killed (signal 9 or exit status 137) or if its peak resident
+        set size reached the memory requested in *job_memory_bytes*.
+        """
+        if retval.exitStatus == 137:
+            return True
+
+        if retval.hasSignal and \
+           str(retval.terminatedSignal) in ("SIGKILL", "9"):
+            return True
+
+        if job_memory_bytes:
+            key = self.map_drmaa2benchmark_data.get("max_rss", "max_rss")
+            for r in resource_usage:
+                try:
+                    max_rss = float(r.resourceUsage.get(key, 0)) * self.max_rss_unit
+                except (TypeError, ValueError):
+                    continue
+                if max_rss >= 0.95 * job_memory_bytes:
+                    return True
+
+        return False
+
     def collect_single_job_from_cluster(self,
                                         job_id,
                                         statement,
                                         stdout_path, stderr_path,
-                                        job_path):
+                                        job_path,
+                                        job_memory_bytes=None):
         '''collects a single job on the cluster.
 
         This method waits until a job has completed and returns
         stdout, stderr and resource usage.
+
+        Raises :class:`JobMemoryError` if the job failed because it
+        exceeded its memory, see :meth:`is_memory_error`, and OSError
+        for any other failure.
         '''
         try:
             retval = self.session.wait(
@@ -136,15 +191,12 @@ class DRMAACluster(object):
                                  retval.hasSignal, retval.terminatedSignal,
                                  statement))
 
-            if error_msg:
-                if stderr:
-                    error_msg += "\n stderr = {}".format("".join(stderr))
-                if self.ignore_errors:
-                    get_logger().warning(error_msg)
-                else:
-                    raise OSError(error_msg)
         else:
-            retval = JobInfo(job_id, {})
+            error_msg = None
+
+        job_info = retval
+        if job_info is None:
+            job_info = JobInfo(job_id, {})
 
         # get hostname from job script
         try:
@@ -153,11 +205,21 @@ class DRMAACluster(object):
             hostname = "unknown"
 
         try:
-            resource_usage = self.get_resource_usage(job_id, retval, hostname)
+            resource_usage = self.get_resource_usage(job_id, job_info, hostname)
         except (ValueError, KeyError, TypeError, IndexError) as ex:
             E.warn("could not collect resource usage for job {}: {}".format(job_id, ex))
-            retval.resourceUsage["hostname"] = hostname
-            resource_usage = [retval]
+            job_info.resourceUsage["hostname"] = hostname
+            resource_usage = [job_info]
+
+        if error_msg:
+            if stderr:
+                error_msg += "\n stderr = {}".format("".join(stderr))
+            if self.ignore_errors:
+                get_logger().warning(error_msg)
+            elif self.is_memory_error(retval, resource_usage, job_memory_bytes):
+                raise JobMemoryError(error_msg, resource_usage)
+            else:
+                raise OSError(error_msg)
 
         try:
             os.unlink(job_path)
@@ -316,6 +378,11 @@ class SGECluster(DRMAACluster):
 
 class SlurmCluster(DRMAACluster):
 
+    task_id_variable = "SLURM_ARRAY_TASK_ID"
+
+    # accounting data is converted to bytes
+    max_rss_unit = 1
+
     map_drmaa2benchmark_data = {
         "hostname": "NodeList",
         "job_id": "JobID",
@@ -446,6 +513,8 @@ class SlurmCluster(DRMAACluster):
 
 class TorqueCluster(DRMAACluster):
 
+    task_id_variable = "PBS_ARRAYID"
+
     def get_native_specification(self,
                                  job_name,
                                  job_memory,
@@ -490,13 +559,15 @@ class TorqueCluster(DRMAACluster):
     def update_template(self, jt):
         # There is no equivalent to sge -V option for pbs-drmaa
         # recreating this...
-        jt.jobEnvironment = os.environ
-        jt.jobEnvironment.update({'BASH_ENV': os.path.join(os.path.expanduser("~"),
-                                                           '.bashrc')})
+        bash_env = jt.jobEnvironment.get('BASH_ENV', '~/.bashrc')
+        jt.jobEnvironment = dict(os.environ,
+                                 BASH_ENV=os.path.expanduser(bash_env))
 
 
 class PBSProCluster(DRMAACluster):
 
+    task_id_variable = "PBS_ARRAY_INDEX"
+
     def get_native_specification(self,
                                  job_name,
                                  job_memory,
@@ -560,9 +631,9 @@ class PBSProCluster(DRMAACluster):
     def update_template(self, jt):
         # The directive #PBS -V exists and works in a qsub script but errors here
         # so using the following as for torque:
-        jt.jobEnvironment = os.environ
-        jt.jobEnvironment.update(
-            {'BASH_ENV': os.path.join(os.path.expanduser("~"), '.bashrc')})
+        bash_env = jt.jobEnvironment.get('BASH_ENV', '~/.bashrc')
+        jt.jobEnvironment = dict(os.environ,
+                                 BASH_ENV=os.path.expanduser(bash_env))
 
 
 def get_queue_manager(queue_manager, *args, **kwargs):
@@ -47,7 +47,7 @@ import cgatcore.iotools as iotools
 from cgatcore.pipeline.parameters import input_validation, get_params, get_parameters
 from cgatcore.pipeline.utils import get_caller, get_caller_locals, is_test
 from cgatcore.pipeline.execution import execute, start_session,\
-    close_session
+    close_session, get_admission_controller
 
 
 # redirect os.stat and other OS utilities to cached versions to speed
@@ -1341,6 +1341,10 @@ def run_workflow(args, argv=None, pipeline=None):
 
                     close_session()
 
+                    if args.without_cluster:
+                        logger.info("local job admission: {}".format(
+                            json.dumps(get_admission_controller().get_statistics())))
+
                 elif args.pipeline_action == "show":
                     ruffus.pipeline_printout(
                         args.stdout,
@@ -26,14 +26,22 @@ import sys
 import time
 import math
 import shutil
+import hashlib
+import tempfile
+import threading
+import contextlib
 import gevent
+import gevent.event
+from multiprocessing.pool import ThreadPool
 import cgatcore.experiment as E
 import cgatcore.iotools as iotools
 
 from cgatcore.pipeline.utils import get_caller_locals, get_caller, get_calling_function
-from cgatcore.pipeline.files import get_temp_filename, get_temp_dir
+from cgatcore.pipeline.files import get_temp_filename, get_temp_dir, stage_files
 from cgatcore.pipeline.parameters import substitute_parameters, get_params
-from cgatcore.pipeline.cluster import get_queue_manager, JobInfo
+from cgatcore.pipeline.cluster import get_queue_manager, JobInfo, JobMemoryError
+from cgatcore.pipeline.metrics import get_metrics_store, get_job_resources
+from cgatcore.pipeline.worker import get_worker_pool, close_worker_pool
 
 # talking to a cluster
 try:
@@ -45,9 +53,26 @@ except (ImportError, RuntimeError):
 # global drmaa session
 GLOBAL_SESSION = None
 
+# global monitor for cluster jobs within the drmaa session
+GLOBAL_MONITOR = None
+
+# global rate limit and cap for cluster job submissions
+GLOBAL_THROTTLE = None
+
+# global admission controller for local jobs
+GLOBAL_ADMISSION_CONTROLLER = None
+
+# paths of job preambles written in this session
+GLOBAL_JOB_PREAMBLES = {}
+
+# paths of environment snapshots captured in this session
+GLOBAL_ENVIRONMENT_SNAPSHOTS = {}
+
 # Timeouts for event loop
 GEVENT_TIMEOUT_STARTUP = 5
 GEVENT_TIMEOUT_WAIT = 30
+# Shortest interval between polling the status of cluster jobs
+GEVENT_TIMEOUT_POLL = 1
 
 
 # dictionary mapping job metrics to data type
@@ -134,13 +159,542 @@ def start_session():
 
 
 def close_session():
-    """close the global DRMAA session."""
-    global GLOBAL_SESSION
+    """close the global DRMAA session and stop warm workers."""
+    global GLOBAL_SESSION, GLOBAL_MONITOR, GLOBAL_THROTTLE
+
+    if GLOBAL_MONITOR is not None:
+        GLOBAL_MONITOR.stop()
+        GLOBAL_MONITOR = None
+
+    if GLOBAL_THROTTLE is not None:
+        get_logger().info("job submission: {}".format(
+            json.dumps(GLOBAL_THROTTLE.get_statistics())))
+        GLOBAL_THROTTLE = None
 
     if GLOBAL_SESSION is not None:
         GLOBAL_SESSION.exit()
         GLOBAL_SESSION = None
 
+    close_worker_pool()
+
+
+# Version of the job preamble. Increment whenever the functions
+# below change in a way that is incompatible with existing job
+# scripts.
+JOB_PREAMBLE_VERSION = 4
+
+# Format of a record in the index of array job statements,
+# containing the byte offset and length of a statement.
+STATEMENT_INDEX_FORMAT = "{:20d} {:20d}\n"
+STATEMENT_INDEX_RECORD_SIZE = len(STATEMENT_INDEX_FORMAT.format(0, 0))
+
+# Shell functions sourced by all job scripts.
+JOB_PREAMBLE = """# cgatcore job preamble, version {version}
+
+# create a temporary directory below $1 and export it as TMPDIR
+cgat_setup_tmpdir() {{
+    mkdir -p "$1"
+    TMPDIR=$(mktemp -d -p "$1")
+    export TMPDIR
+}}
+
+cgat_clean_tmpdir() {{
+    rm -rf "$TMPDIR"
+}}
+
+# output times whenever the script exits
+cgat_info() {{
+    echo 'benchmark'; hostname; times
+}}
+
+# restrict virtual memory to $1 kb. Errors are ignored as
+# setting limits is often not permitted.
+cgat_set_memory_limit() {{
+    set +e
+    ulimit -v "$1" > /dev/null
+    ulimit -m "$1" > /dev/null
+    ulimit -H -v > /dev/null
+    set -e
+}}
+
+# output low-level debugging information for job $1 with
+# script $2 to the shell log file $3
+cgat_log_shell() {{
+    mkdir -p "$(dirname "$3")"
+    echo "$1 : START -> $2" >> "$3"
+    set | sed "s/^/$1 : /" >> "$3"
+    pwd | sed "s/^/$1 : /" >> "$3"
+    hostname | sed "s/^/$1: /" >> "$3"
+    if [ -r /proc/meminfo ]; then
+        cat /proc/meminfo | sed "s/^/$1: /" >> "$3"
+    elif command -v vm_stat > /dev/null; then
+        vm_stat | sed "s/^/$1: /" >> "$3"
+    fi
+    echo "$1 : END -> $2" >> "$3"
+    ulimit | sed "s/^/$1: /" >> "$3"
+}}
+
+# copy input file $1 to $2 on node-local scratch
+cgat_stage_in() {{
+    mkdir -p "$(dirname "$2")"
+    cp "$1" "$2"
+}}
+
+# copy output file $1 from node-local scratch to $2, which is
+# only replaced once the copy is complete
+cgat_stage_out() {{
+    mkdir -p "$(dirname "$2")"
+    cp "$1" "$2.staging.$$"
+    mv -f "$2.staging.$$" "$2"
+}}
+
+# output statement number $3 (1-based) from the statement file $1
+# using the index $2, see write_statement_index()
+cgat_get_statement() {{
+    local offset length
+    read -r offset length <<< "$({{ tail -c +$(( ($3 - 1) * {record_size} + 1 )) "$2" || true; }} | head -c {record_size})"
+    {{ tail -c +$(( offset + 1 )) "$1" || true; }} | head -c "$length"
+}}
+
+# run statement $3 from statement file $1 with index $2 using the
+# shell options $5 and append a record with its exit status, start
+# and end time and user and system time to $4
+cgat_run_bundle_member() {{
+    local start end status=0 statement times_self times_children
+    local times_file="$TMPDIR/cgat_times_$3"
+    statement=$(cgat_get_statement "$1" "$2" "$3")
+    start=$(date +%s)
+    bash $5 -c "$statement" || status=$?
+    end=$(date +%s)
+    # times needs to run in this shell to report the statement
+    times > "$times_file"
+    {{ read -r times_self; read -r times_children; }} < "$times_file"
+    rm -f "$times_file"
+    echo "$3 $status $start $end $times_children" >> "$4"
+}}
+
+# run statements $3 to $4 from statement file $1 with index $2,
+# at most $5 at a time, see cgat_run_bundle_member
+cgat_run_bundle() {{
+    local task
+    for (( task=$3; task<=$4; task++ )); do
+        while [ "$(jobs -pr | wc -l)" -ge "$5" ]; do
+            wait -n || true
+        done
+        cgat_run_bundle_member "$1" "$2" "$task" "$6" "$7" &
+    done
+    wait
+}}
+"""
+
+
+def get_job_preamble(dir=None):
+    """return the path of the shell preamble sourced by job scripts.
+
+    The preamble is written once per session to *dir*, which defaults
+    to the shared temporary directory. Its filename contains the
+    version and a checksum of its contents, so that a preamble written
+    by a previous session is re-used only if it is identical.
+
+    Arguments
+    ---------
+    dir : string
+        Directory to write the preamble to.
+
+    Returns
+    -------
+    filename : string
+        Absolute path of the preamble.
+    """
+    if dir is None:
+        dir = get_params()["shared_tmpdir"]
+
+    if dir not in GLOBAL_JOB_PREAMBLES:
+        contents = JOB_PREAMBLE.format(
+            version=JOB_PREAMBLE_VERSION,
+            record_size=STATEMENT_INDEX_RECORD_SIZE)
+        filename = os.path.abspath(os.path.join(
+            dir, "cgat_job_preamble_v{}_{}.sh".format(
+                JOB_PREAMBLE_VERSION,
+                hashlib.md5(contents.encode("utf-8")).hexdigest()[:8])))
+
+        if not os.path.exists(filename):
+            if not os.path.exists(dir):
+                os.makedirs(dir)
+            # write atomically as several pipelines might share
+            # the same directory
+            fd, tmpfilename = tempfile.mkstemp(dir=dir, prefix="ctmp")
+            with os.fdopen(fd, "w") as outf:
+                outf.write(contents)
+            os.chmod(tmpfilename, stat.S_IRUSR | stat.S_IWUSR |
+                     stat.S_IRGRP | stat.S_IROTH)
+            os.rename(tmpfilename, filename)
+
+        GLOBAL_JOB_PREAMBLES[dir] = filename
+
+    return GLOBAL_JOB_PREAMBLES[dir]
+
+
+# variables that are specific to a shell, host or job and are not
+# part of environment snapshots
+ENVIRONMENT_SNAPSHOT_EXCLUDE = re.compile(
+    r"^(_|PWD|OLDPWD|SHLVL|BASH_ENV|PS1|PS2|PROMPT_COMMAND|TERM|DISPLAY|"
+    r"HOST|HOSTNAME|TMPDIR|SSH_\w*|SGE_\w*|JOB_\w*|SLURM_\w*|PBS_\w*)$")
+
+
+def get_environment_snapshot(condaenv=None, init="~/.bashrc", dir=None):
+    """return the path of a snapshot of the job environment.
+
+    The snapshot contains the environment variables after sourcing the
+    shell initialisation file *init* and, optionally, activating the
+    conda environment *condaenv*. It is written as a file of ``export``
+    statements that jobs source through ``BASH_ENV`` instead of the
+    initialisation file, so that the shell initialisation and the
+    conda lookup are run once instead of once per job.
+
+    Snapshots are stored in *dir*, which defaults to the shared
+    temporary directory. Their filename contains a checksum of the
+    current environment, the initialisation file and *condaenv*, so
+    that other processes of the same session re-use the snapshot.
+    Delete the snapshot files to force a new capture.
+
+    Arguments
+    ---------
+    condaenv : string
+        Name of a conda environment to activate.
+    init : string
+        Shell initialisation file.
+    dir : string
+        Directory to write the snapshot to.
+
+    Returns
+    -------
+    filename : string
+        Absolute path of the snapshot.
+    """
+    if dir is None:
+        dir = get_params()["shared_tmpdir"]
+
+    key = (dir, init, condaenv)
+    if key in GLOBAL_ENVIRONMENT_SNAPSHOTS:
+        return GLOBAL_ENVIRONMENT_SNAPSHOTS[key]
+
+    init = os.path.expanduser(init)
+    environment = dict([(x, y) for x, y in os.environ.items()
+                        if x != "BASH_ENV"])
+    checksum = hashlib.md5()
+    for k, v in sorted(environment.items()):
+        checksum.update("{}={}\0".format(k, v).encode("utf-8"))
+    if os.path.exists(init):
+        checksum.update("{}:{}".format(
+            init, os.stat(init).st_mtime).encode("utf-8"))
+    checksum.update(str(condaenv).encode("utf-8"))
+
+    filename = os.path.abspath(os.path.join(
+        dir, "cgat_env_{}_{}.sh".format(
+            condaenv or "base", checksum.hexdigest()[:8])))
+
+    if not os.path.exists(filename):
+        commands = []
+        if os.path.exists(init):
+            commands.append("source {} > /dev/null 2>&1".format(
+                shellquote(init)))
+        if condaenv:
+            commands.append(
+                'eval "$({} shell.bash hook)" && conda activate {}'.format(
+                    environment.get("CONDA_EXE", "conda"),
+                    shellquote(condaenv)))
+        commands.append("env -0")
+
+        process = subprocess.Popen(
+            ["/bin/bash", "--noprofile", "--norc", "-c",
+             "; ".join(commands)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=environment)
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            raise OSError(
+                "could not capture environment of {}: {}".format(
+                    condaenv or init, stderr.decode("utf-8", "replace")))
+
+        lines = []
+        for entry in stdout.decode("utf-8", "replace").split("\0"):
+            name, sep, value = entry.partition("=")
+            if not sep or not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name):
+                continue
+            if ENVIRONMENT_SNAPSHOT_EXCLUDE.match(name):
+                continue
+            lines.append("export {}={}\n".format(name, shellquote(value)))
+
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        # write atomically as several processes might capture
+        # the same environment
+        fd, tmpfilename = tempfile.mkstemp(dir=dir, prefix="ctmp")
+        with os.fdopen(fd, "w") as outf:
+            outf.write("".join(lines))
+        os.rename(tmpfilename, filename)
+        get_logger().info("captured environment of {} in {}".format(
+            condaenv or init, filename))
+
+    GLOBAL_ENVIRONMENT_SNAPSHOTS[key] = filename
+    return filename
+
+
+def get_bash_env(options):
+    """return the file that jobs source through ``BASH_ENV``.
+
+    This is the environment snapshot (see
+    :func:`get_environment_snapshot`) if ``environment_snapshot`` is
+    set in *options* and the shell initialisation file
+    ``environment_init`` otherwise.
+    """
+    init = options.get("environment_init", "~/.bashrc")
+    if options.get("environment_snapshot", False):
+        return get_environment_snapshot(
+            condaenv=options.get("job_condaenv", None),
+            init=init)
+    return os.path.expanduser(init)
+
+
+def write_statement_index(statements, filename):
+    """write *statements* to *filename* together with an index
+    in *filename* + ``.index``.
+
+    The index contains fixed size records with the byte offset and
+    length of each statement, so that an array task can look up its
+    statement without scanning the whole file. Statements may span
+    multiple lines.
+
+    Arguments
+    ---------
+    statements : list
+        List of statements.
+    filename : string
+        Filename of the statement file.
+
+    Returns
+    -------
+    index_filename : string
+        Filename of the index.
+    """
+    index_filename = filename + ".index"
+    offset = 0
+    with open(filename, "wb") as outf, open(index_filename, "w") as outf_index:
+        for statement in statements:
+            data = statement.encode("utf-8")
+            outf.write(data)
+            outf_index.write(STATEMENT_INDEX_FORMAT.format(offset, len(data)))
+            offset += len(data)
+    return index_filename
+
+
+def read_statement_from_index(filename, task_id):
+    """return statement number *task_id* (1-based) from a statement
+    file written by :func:`write_statement_index`."""
+    with open(filename + ".index") as inf:
+        inf.seek((task_id - 1) * STATEMENT_INDEX_RECORD_SIZE)
+        offset, length = map(int, inf.read(STATEMENT_INDEX_RECORD_SIZE).split())
+    with open(filename, "rb") as inf:
+        inf.seek(offset)
+        return inf.read(length).decode("utf-8")
+
+
+def pack_statements(durations, capacity):
+    """pack statements into bundles of at most *capacity* seconds.
+
+    Statements are assigned to bundles by decreasing duration, each
+    to the first bundle it fits in. Statements exceeding *capacity*
+    are put into a bundle of their own.
+
+    Arguments
+    ---------
+    durations : list
+        Estimated duration of each statement in seconds.
+    capacity : float
+        Total duration of statements in a bundle.
+
+    Returns
+    -------
+    bundles : list
+        List of bundles, each a list of statement indices in
+        ascending order.
+    """
+    bundles, totals = [], []
+    for index in sorted(range(len(durations)),
+                        key=lambda x: durations[x],
+                        reverse=True):
+        duration = durations[index]
+        for bundle, total in enumerate(totals):
+            if total + duration <= capacity:
+                bundles[bundle].append(index)
+                totals[bundle] += duration
+                break
+        else:
+            bundles.append([index])
+            totals.append(duration)
+
+    return [sorted(x) for x in bundles]
+
+
+def parse_bundle_status(lines):
+    """parse status records written by ``cgat_run_bundle``.
+
+    Returns a dictionary mapping the 1-based statement number to
+    a dictionary of exit status, start and end time and user and
+    system time.
+    """
+
+    def to_seconds(value):
+        minutes, seconds = re.match(r"(\d+)m([\d.]+)s", value).groups()
+        return 60 * int(minutes) + float(seconds)
+
+    status = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 6:
+            continue
+        task, exit_status, start_time, end_time, user_t, sys_t = fields
+        status[int(task)] = {
+            "exit_status": int(exit_status),
+            "start_time": float(start_time),
+            "end_time": float(end_time),
+            "user_t": to_seconds(user_t),
+            "sys_t": to_seconds(sys_t)}
+    return status
+
+
+def get_host_memory():
+    """return the physical memory of the host in bytes."""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+class AdmissionController(object):
+    """a token pool for cores and memory shared by all jobs that are
+    executed on the local host.
+
+    Jobs acquire cores and memory before they are launched and release
+    them once they have finished. A job that does not fit into the
+    currently available resources waits until enough resources have
+    been released. Jobs are admitted as soon as they fit, so small
+    jobs might be started ahead of large jobs that are waiting in
+    order to keep as many cores busy as possible.
+
+    Requests exceeding the total capacity are capped at the capacity,
+    so that these jobs run once the host is otherwise idle.
+
+    Arguments
+    ---------
+    cores : int
+        Number of cores available for jobs. Defaults to all cores of
+        the host.
+    memory : int
+        Memory in bytes available for jobs. Defaults to the physical
+        memory of the host.
+    """
+
+    def __init__(self, cores=None, memory=None):
+        self.cores = cores or os.cpu_count()
+        self.memory = memory or get_host_memory()
+        self.available_cores = self.cores
+        self.available_memory = self.memory
+        self.condition = threading.Condition()
+
+        # queueing statistics
+        self.num_admitted = 0
+        self.num_queued = 0
+        self.queue_length = 0
+        self.max_queue_length = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def fits(self, cores, memory):
+        return cores <= self.available_cores and \
+            memory <= self.available_memory
+
+    def acquire(self, cores, memory):
+        """acquire *cores* and *memory* (bytes), blocking until these
+        are available.
+
+        Returns a token to be passed to :meth:`release`.
+        """
+        cores = min(max(0, int(cores)), self.cores)
+        memory = min(max(0, int(memory)), self.memory)
+
+        start_time = time.time()
+        with self.condition:
+            if not self.fits(cores, memory):
+                self.num_queued += 1
+                self.queue_length += 1
+                self.max_queue_length = max(self.max_queue_length,
+                                            self.queue_length)
+                while not self.fits(cores, memory):
+                    self.condition.wait()
+                self.queue_length -= 1
+
+            self.available_cores -= cores
+            self.available_memory -= memory
+            self.num_admitted += 1
+
+            wait_time = time.time() - start_time
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        return cores, memory
+
+    def release(self, token):
+        """release resources acquired with :meth:`acquire`."""
+        cores, memory = token
+        with self.condition:
+            self.available_cores += cores
+            self.available_memory += memory
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def admit(self, cores, memory):
+        """context manager acquiring and releasing resources."""
+        token = self.acquire(cores, memory)
+        try:
+            yield token
+        finally:
+            self.release(token)
+
+    def get_statistics(self):
+        """return a dictionary with queueing statistics."""
+        with self.condition:
+            return {"cores": self.cores,
+                    "memory": self.memory,
+                    "available_cores": self.available_cores,
+                    "available_memory": self.available_memory,
+                    "admitted": self.num_admitted,
+                    "queued": self.num_queued,
+                    "queue_length": self.queue_length,
+                    "max_queue_length": self.max_queue_length,
+                    "total_wait_time": self.total_wait_time,
+                    "max_wait_time": self.max_wait_time,
+                    "mean_wait_time": self.total_wait_time / max(1, self.num_admitted)}
+
+
+def get_admission_controller():
+    """return the global admission controller for local jobs.
+
+    The controller is created on first use. Its capacity is taken from
+    the configuration values ``local_cores`` and ``local_memory``, which
+    default to the cores and physical memory of the host.
+    """
+    global GLOBAL_ADMISSION_CONTROLLER
+
+    if GLOBAL_ADMISSION_CONTROLLER is None:
+        params = get_params()
+        memory = params.get("local_memory", None)
+        if memory:
+            memory = iotools.human2bytes(str(memory))
+        GLOBAL_ADMISSION_CONTROLLER = AdmissionController(
+            cores=params.get("local_cores", None),
+            memory=memory)
+    return GLOBAL_ADMISSION_CONTROLLER
+
 
 def shellquote(statement):
     '''shell quote a string to be used as a function argument.
@@ -237,15 +791,15 @@ def execute(statement, **kwargs):
         statement = statement[:-1]
 
     # always use bash
-    os.environ.update(
-        {'BASH_ENV': os.path.join(os.environ['HOME'], '.bashrc')})
+    env = os.environ.copy()
+    env["BASH_ENV"] = get_bash_env(kwargs)
     process = subprocess.Popen(statement % kwargs,
                                cwd=cwd,
                                shell=True,
                                stdin=sys.stdin,
                                stdout=sys.stdout,
                                stderr=sys.stderr,
-                               env=os.environ.copy(),
+                               env=env,
                                executable="/bin/bash")
 
     # process.stdin.close()
@@ -376,6 +930,279 @@ def join_statements(statements, infile, outfile=None):
     return last_file, result, "rm -f %s*" % prefix
 
 
+def get_job_states(session, job_ids):
+    """return a dictionary mapping each job id in *job_ids* to its
+    DRMAA job state.
+
+    Jobs that are no longer known to the session have been collected
+    already and are reported as done.
+    """
+    states = {}
+    for job_id in job_ids:
+        try:
+            states[job_id] = session.jobStatus(job_id)
+        except drmaa.errors.InvalidJobException:
+            states[job_id] = drmaa.JobState.DONE
+    return states
+
+
+def get_polling_interval(interval, num_changed, min_interval, max_interval):
+    """return the interval until the next polling cycle.
+
+    If jobs changed their state in the last cycle, more changes are
+    likely to follow soon and the interval is halved. Otherwise it
+    is increased by half up to *max_interval*.
+    """
+    if num_changed > 0:
+        interval = interval / 2.0
+    else:
+        interval = interval * 1.5
+    return max(min_interval, min(max_interval, interval))
+
+
+class JobMonitor(object):
+    """monitor the state of all cluster jobs within a DRMAA session.
+
+    A single greenlet polls the state of all outstanding jobs,
+    independent of the number of tasks waiting for jobs to finish.
+    Executors register the jobs they have submitted with :meth:`wait`,
+    which returns once all of them have finished.
+
+    Polling follows :func:`get_polling_interval` with the interval
+    bounded by *min_interval* and by *max_interval_running* if any
+    job is running or *max_interval_queued* otherwise.
+    """
+
+    def __init__(self, session,
+                 min_interval=GEVENT_TIMEOUT_POLL,
+                 max_interval_queued=GEVENT_TIMEOUT_WAIT,
+                 max_interval_running=GEVENT_TIMEOUT_WAIT):
+        self.session = session
+        self.min_interval = min_interval
+        self.max_interval_queued = max_interval_queued
+        self.max_interval_running = max_interval_running
+        # map of job id to result object of jobs that are outstanding
+        self.jobs = {}
+        self.wakeup = gevent.event.Event()
+        self.greenlet = None
+        self.num_cycles = 0
+        self.num_queries = 0
+
+    def watch(self, job_ids):
+        """start monitoring jobs in *job_ids*.
+
+        Returns a dictionary mapping job ids to
+        :class:`gevent.event.AsyncResult` objects that are set to the
+        final state of each job.
+        """
+        results = dict([(job_id, self.jobs.setdefault(
+            job_id, gevent.event.AsyncResult())) for job_id in job_ids])
+
+        if self.greenlet is None or self.greenlet.dead:
+            self.greenlet = gevent.spawn(self.run)
+        # wake up the monitor if it is idle
+        self.wakeup.set()
+        return results
+
+    def wait(self, job_ids):
+        """wait for all jobs in *job_ids* to finish.
+
+        Returns a dictionary mapping job ids to their final state.
+        """
+        results = self.watch(job_ids)
+        return dict([(job_id, result.get()) for job_id, result in results.items()])
+
+    def poll(self):
+        """query the state of all outstanding jobs once and notify
+        waiting executors of jobs that have finished.
+
+        Returns a tuple of the number of finished jobs and a flag
+        indicating whether any job is running.
+        """
+        job_ids = list(self.jobs.keys())
+        self.num_cycles += 1
+        states = get_job_states(self.session, job_ids)
+        self.num_queries += len(job_ids)
+
+        num_finished = 0
+        for job_id, state in states.items():
+            if state in (drmaa.JobState.DONE, drmaa.JobState.FAILED):
+                self.jobs.pop(job_id).set(state)
+                num_finished += 1
+
+        return num_finished, drmaa.JobState.RUNNING in states.values()
+
+    def run(self):
+        interval = self.min_interval
+        while True:
+            if not self.jobs:
+                self.wakeup.clear()
+                self.wakeup.wait()
+                interval = self.min_interval
+                continue
+
+            try:
+                num_finished, is_running = self.poll()
+            except Exception as ex:
+                # propagate error to all waiting executors
+                for result in self.jobs.values():
+                    result.set_exception(ex)
+                self.jobs.clear()
+                continue
+
+            if is_running:
+                max_interval = self.max_interval_running
+            else:
+                max_interval = self.max_interval_queued
+
+            interval = get_polling_interval(interval,
+                                            num_finished,
+                                            self.min_interval,
+                                            max_interval)
+            if self.jobs:
+                gevent.sleep(interval)
+
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
+        get_logger().info(
+            "job monitor: {} polling cycles, {} job state queries".format(
+                self.num_cycles, self.num_queries))
+
+
+def get_job_monitor():
+    """return the monitor for jobs in the global DRMAA session.
+
+    The monitor is created on first use with polling intervals taken
+    from the cluster configuration values ``monitor_interval_min_default``,
+    ``monitor_interval_queued_default`` and
+    ``monitor_interval_running_default``.
+    """
+    global GLOBAL_MONITOR
+
+    if GLOBAL_SESSION is None:
+        raise ValueError("no Grid Session found")
+
+    if GLOBAL_MONITOR is None or GLOBAL_MONITOR.session is not GLOBAL_SESSION:
+        cluster_params = get_params()["cluster"]
+        GLOBAL_MONITOR = JobMonitor(
+            GLOBAL_SESSION,
+            min_interval=cluster_params.get(
+                "monitor_interval_min_default", GEVENT_TIMEOUT_POLL),
+            max_interval_queued=cluster_params.get(
+                "monitor_interval_queued_default", GEVENT_TIMEOUT_WAIT),
+            max_interval_running=cluster_params.get(
+                "monitor_interval_running_default", GEVENT_TIMEOUT_WAIT))
+    return GLOBAL_MONITOR
+
+
+class SubmissionThrottle(object):
+    """limit the rate of job submissions and the number of jobs in
+    flight across all executors in a DRMAA session.
+
+    Submissions draw tokens from a bucket holding up to *burst* tokens
+    that is refilled at *rate* tokens per second. Independently, no
+    more than *max_jobs* jobs may be queued or running at any time.
+    Requests for more jobs than *max_jobs*, for example large array
+    jobs, are capped at *max_jobs*, so that they are submitted once
+    all other jobs have finished.
+
+    Arguments
+    ---------
+    rate : float
+        Number of submissions per second.
+    burst : int
+        Number of submissions that can be made in quick succession.
+    max_jobs : int
+        Maximum number of jobs in flight.
+    """
+
+    def __init__(self, rate=10, burst=20, max_jobs=100):
+        if rate <= 0:
+            raise ValueError("submission rate needs to be positive")
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.max_jobs = max(1, int(max_jobs))
+        self.tokens = float(self.burst)
+        self.last_refill = time.time()
+        self.in_flight = 0
+        self.released = gevent.event.Event()
+
+        # submission statistics
+        self.num_submitted = 0
+        self.max_in_flight = 0
+        self.total_wait_time = 0.0
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(float(self.burst),
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self, num_jobs=1):
+        """block until *num_jobs* jobs can be submitted.
+
+        Returns the number of jobs that have been accounted for, which
+        needs to be passed to :meth:`release` once they have finished.
+        """
+        num_jobs = min(max(1, num_jobs), self.max_jobs)
+        num_tokens = min(num_jobs, self.burst)
+        start_time = time.time()
+
+        while self.in_flight + num_jobs > self.max_jobs:
+            self.released.clear()
+            self.released.wait()
+
+        # jobs in flight are reserved before waiting for tokens
+        # so that waiting submissions do not overtake each other
+        self.in_flight += num_jobs
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        self.refill()
+        while self.tokens < num_tokens:
+            gevent.sleep((num_tokens - self.tokens) / self.rate)
+            self.refill()
+        self.tokens -= num_tokens
+
+        self.num_submitted += num_jobs
+        self.total_wait_time += time.time() - start_time
+        return num_jobs
+
+    def release(self, num_jobs=1):
+        """release *num_jobs* jobs acquired with :meth:`acquire`."""
+        self.in_flight = max(0, self.in_flight - num_jobs)
+        self.released.set()
+
+    def get_statistics(self):
+        """return a dictionary with submission statistics."""
+        return {"rate": self.rate,
+                "burst": self.burst,
+                "max_jobs": self.max_jobs,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "submitted": self.num_submitted,
+                "total_wait_time": self.total_wait_time}
+
+
+def get_submission_throttle():
+    """return the submission throttle for the global DRMAA session.
+
+    The throttle is created on first use with its limits taken from
+    the cluster configuration values ``submission_rate``,
+    ``submission_burst`` and ``num_jobs``.
+    """
+    global GLOBAL_THROTTLE
+
+    if GLOBAL_THROTTLE is None:
+        cluster_params = get_params()["cluster"]
+        GLOBAL_THROTTLE = SubmissionThrottle(
+            rate=cluster_params.get("submission_rate", 10),
+            burst=cluster_params.get("submission_burst", 20),
+            max_jobs=cluster_params.get("num_jobs", 100))
+    return GLOBAL_THROTTLE
+
+
 def will_run_on_cluster(options):
     run_on_cluster = options.get("to_cluster", True) and \
         not options.get("without_cluster", False) and \
@@ -386,6 +1213,9 @@ def will_run_on_cluster(options):
 
 class Executor(object):
 
+    # size of the unit of max_rss in benchmark data in bytes
+    max_rss_unit = 1024
+
     def __init__(self, **kwargs):
 
         self.logger = get_logger()
@@ -437,27 +1267,98 @@ class Executor(object):
 
         self.work_dir = get_params()["work_dir"]
 
+        # file sourced by the job shell
+        self.bash_env = get_bash_env(kwargs)
+
         self.shellfile = kwargs.get("shell_logfile", None)
         if self.shellfile:
             if not self.shellfile.startswith(os.sep):
                 self.shellfile = os.path.join(
                     self.work_dir, os.path.basename(self.shellfile))
 
-        self.monitor_interval_queued = kwargs.get('monitor_interval_queued', None)
-        if self.monitor_interval_queued is None:
-            self.monitor_interval_queued = get_params()["cluster"].get(
-                'monitor_interval_queued_default', GEVENT_TIMEOUT_WAIT)
-        self.monitor_interval_running = kwargs.get('monitor_interval_running', None)
-        if self.monitor_interval_running is None:
-            self.monitor_interval_running = get_params()["cluster"].get(
-                'monitor_interval_running_default', GEVENT_TIMEOUT_WAIT)
-
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         pass
 
+    def size_from_metrics(self, statement_list):
+        """set job_threads, job_memory and the queue from the resource
+        usage of previous jobs in the metrics store.
+
+        Resources are unchanged if there is no history for the
+        statements. See :func:`get_job_resources`.
+        """
+        store = get_metrics_store()
+        if store is None:
+            return
+
+        usage = store.get_usage(self.task_name, statement_list)
+        if usage is None:
+            return
+
+        resources = get_job_resources(
+            usage,
+            self.job_threads,
+            memory_margin=self.options.get("metrics_memory_margin", 1.5),
+            runtime_margin=self.options.get("metrics_runtime_margin", 1.5),
+            queues=self.options.get("metrics_queues", None))
+
+        self.logger.info(
+            "sizing job from {} previous jobs: usage={}, resources={}".format(
+                usage["jobs"], usage, resources))
+
+        self.job_threads = resources["job_threads"]
+        if "job_memory" in resources:
+            self.job_memory = resources["job_memory"]
+            self.job_total_memory = iotools.bytes2human(
+                iotools.human2bytes(self.job_memory) * self.job_threads)
+        if "job_queue" in resources:
+            # do not modify the global cluster options
+            self.options["cluster"] = dict(self.options["cluster"],
+                                           queue=resources["job_queue"])
+
+    def get_job_memory_bytes(self):
+        """return the total memory requested by a job in bytes.
+
+        Returns 0 if memory is unlimited.
+        """
+        if self.job_memory == "unlimited":
+            return 0
+        return iotools.human2bytes(str(self.job_memory)) * self.job_threads
+
+    def escalate_memory(self, factor, memory_max=None):
+        """increase the memory requested per thread by *factor*.
+
+        The total memory of a job is limited to *memory_max*.
+
+        Returns False if memory can not be increased.
+        """
+        if self.job_memory == "unlimited":
+            return False
+
+        memory = iotools.human2bytes(str(self.job_memory))
+        escalated = memory * factor
+        if memory_max:
+            escalated = min(escalated,
+                            iotools.human2bytes(str(memory_max)) / self.job_threads)
+        if escalated <= memory:
+            return False
+
+        self.job_memory = "{}M".format(int(math.ceil(escalated / 2 ** 20)))
+        self.job_total_memory = "{}M".format(
+            int(math.ceil(escalated * self.job_threads / 2 ** 20)))
+        self.logger.info("escalated job memory to {} per thread".format(
+            self.job_memory))
+        return True
+
+    def admit_job(self):
+        """return a context manager that blocks until the resources
+        required by a job are available on the local host.
+        """
+        return get_admission_controller().admit(
+            self.job_threads, self.get_job_memory_bytes())
+
     def expand_statement(self, statement):
         '''add generic commands before and after statement.
 
@@ -529,7 +1430,8 @@ class Executor(object):
                                   set -e
                                   }}'''.format(**locals())))
 
-        if "job_condaenv" in self.options:
+        if "job_condaenv" in self.options and \
+           not self.options.get("environment_snapshot", False):
             # In conda < 4.4 there is an issue with parallel activations,
             # see https://github.com/conda/conda/issues/2837 .
             # This has been fixed in conda 4.4, but we are on conda
@@ -554,123 +1456,136 @@ class Executor(object):
 
         return statement, cleanup_funcs
 
+    def stage_statement(self, statement):
+        """stage files through node-local scratch space.
+
+        Files listed in the options ``stage_in`` and ``stage_out``
+        are replaced in *statement* by paths within ``$TMPDIR``. Input
+        files are copied there before the statement is executed and
+        output files are copied back once it has completed
+        successfully.
+
+        Returns
+        -------
+        statement : string
+            The statement with staged paths replaced.
+        stage_in : list
+            Commands to copy input files and to create directories
+            for output files.
+        stage_out : list
+            Commands to copy output files.
+        """
+        stage_in, stage_out = [], []
+        replacements = []
+        for direction, cmds in (("in", stage_in), ("out", stage_out)):
+            filenames = self.options.get("stage_{}".format(direction), None)
+            if not filenames:
+                continue
+            if isinstance(filenames, str):
+                filenames = [filenames]
+            for idx, filename in enumerate(filenames):
+                local_path = "$TMPDIR/stage_{}/{}/{}".format(
+                    direction, idx, os.path.basename(filename))
+                if direction == "in":
+                    cmds.append('cgat_stage_in {} "{}"'.format(
+                        filename, local_path))
+                else:
+                    stage_in.append('mkdir -p "{}"'.format(
+                        os.path.dirname(local_path)))
+                    cmds.append('cgat_stage_out "{}" {}'.format(
+                        local_path, filename))
+                replacements.append((filename, local_path))
+
+        # replace longer paths first in case one path is a prefix
+        # of another
+        for filename, local_path in sorted(
+                replacements, key=lambda x: len(x[0]), reverse=True):
+            statement = re.sub(
+                r"(?<![\w./-]){}(?![\w./-])".format(re.escape(filename)),
+                lambda m: local_path,
+                statement)
+
+        return statement, stage_in, stage_out
+
     def build_job_script(self,
                          statement):
         '''build job script from statement.
 
-        returns (name_of_script, stdout_path, stderr_path)
-        '''
-        tmpfilename = get_temp_filename(dir=self.work_dir, clear=True)
-        tmpfilename = tmpfilename + ".sh"
+        The script sources the shell functions in the job preamble
+        (see :func:`get_job_preamble`) and only contains the
+        commands specific to this job.
 
+        returns (statement, job_path)
+        '''
         expanded_statement, cleanup_funcs = self.expand_statement(statement)
+        expanded_statement, stage_in, stage_out = self.stage_statement(
+            expanded_statement)
 
-        with open(tmpfilename, "w") as tmpfile:
-            # disabled: -l -O expand_aliases\n" )
+        preamble = get_job_preamble()
 
-            # make executable
-            tmpfile.write("#!/bin/bash -eu\n")
-            if not self.ignore_pipe_errors:
-                tmpfile.write("set -o pipefail\n")
+        lines = ["#!/bin/bash -eu"]
+        if not self.ignore_pipe_errors:
+            lines.append("set -o pipefail")
 
-            os.chmod(tmpfilename, stat.S_IRWXG | stat.S_IRWXU)
+        lines.append("source {}".format(preamble))
+        lines.append("cd {}".format(self.work_dir))
+        if self.output_directories is not None:
+            for outdir in self.output_directories:
+                if outdir:
+                    lines.append("mkdir -p {}".format(outdir))
 
-            tmpfile.write("\ncd {}\n".format(self.work_dir))
-            if self.output_directories is not None:
-                for outdir in self.output_directories:
-                    if outdir:
-                        tmpfile.write("\nmkdir -p {}\n".format(outdir))
+        lines.append("umask 002")
 
-            # create and set system scratch dir for temporary files
-            tmpfile.write("umask 002\n")
+        # create and set system scratch dir for temporary files
+        cluster_tmpdir = get_params()["cluster_tmpdir"]
+        if self.run_on_cluster and cluster_tmpdir:
+            tmpdir = cluster_tmpdir
+        else:
+            tmpdir = get_params()["tmpdir"]
+        lines.append("cgat_setup_tmpdir {}".format(tmpdir))
+
+        for cleanup_func, cleanup_code in cleanup_funcs:
+            lines.append("{}() {}".format(cleanup_func, cleanup_code))
+
+        lines.append("clean_all() {{ {}; }}".format(
+            "; ".join([x[0] for x in cleanup_funcs] +
+                      ["cgat_clean_tmpdir", "cgat_info"])))
+        lines.append("trap clean_all EXIT")
+
+        if self.job_memory not in("unlimited", "etc") and \
+           self.options.get("cluster_memory_ulimit", False):
+            # restrict virtual memory
+            # Note that there are resources in SGE which could do this directly
+            # such as v_hmem.
+            # Note that limiting resident set sizes (RSS) with ulimit is not
+            # possible in newer kernels.
+            # -v and -m accept memory in kb
+            requested_memory_kb = max(
+                1000,
+                int(math.ceil(
+                    iotools.human2bytes(self.job_memory) / 1024 * self.job_threads)))
+            lines.append("cgat_set_memory_limit {}".format(
+                requested_memory_kb))
+
+        lines.extend(stage_in)
+
+        # create the script in a single step with its final permissions
+        fd, job_path = tempfile.mkstemp(dir=self.work_dir,
+                                        prefix="ctmp",
+                                        suffix=".sh")
+        job_path = os.path.abspath(job_path)
+
+        if self.shellfile:
+            # output low-level debugging information to a shell log file
+            lines.append('cgat_log_shell "{}" "{}" "{}"'.format(
+                self.job_name, job_path, self.shellfile))
 
-            cluster_tmpdir = get_params()["cluster_tmpdir"]
+        lines.append(expanded_statement)
+        lines.extend(stage_out)
 
-            if self.run_on_cluster and cluster_tmpdir:
-                tmpdir = cluster_tmpdir
-                tmpfile.write("TMPDIR=`mktemp -d -p {}`\n".format(tmpdir))
-                tmpfile.write("export TMPDIR\n")
-            else:
-                tmpdir = get_temp_dir(dir=get_params()["tmpdir"],
-                                      clear=True)
-                tmpfile.write("mkdir -p {}\n".format(tmpdir))
-                tmpfile.write("export TMPDIR={}\n".format(tmpdir))
-
-            cleanup_funcs.append(
-                ("clean_temp",
-                 "{{ rm -rf {}; }}".format(tmpdir)))
-
-            # output times whenever script exits, preserving
-            # return status
-            cleanup_funcs.append(("info",
-                                  "{ echo 'benchmark'; hostname; times; }"))
-            for cleanup_func, cleanup_code in cleanup_funcs:
-                tmpfile.write("\n{}() {}\n".format(cleanup_func, cleanup_code))
-
-            tmpfile.write("\nclean_all() {{ {}; }}\n".format(
-                "; ".join([x[0] for x in cleanup_funcs])))
-
-            tmpfile.write("\ntrap clean_all EXIT\n\n")
-
-            if self.job_memory not in("unlimited", "etc") and \
-               self.options.get("cluster_memory_ulimit", False):
-                # restrict virtual memory
-                # Note that there are resources in SGE which could do this directly
-                # such as v_hmem.
-                # Note that limiting resident set sizes (RSS) with ulimit is not
-                # possible in newer kernels.
-                # -v and -m accept memory in kb
-                requested_memory_kb = max(
-                    1000,
-                    int(math.ceil(
-                        iotools.human2bytes(self.job_memory) / 1024 * self.job_threads)))
-                # unsetting error exit as often not permissions
-                tmpfile.write("set +e\n")
-                tmpfile.write("ulimit -v {} > /dev/null \n".format(
-                    requested_memory_kb))
-                tmpfile.write("ulimit -m {} > /dev/null \n".format(
-                    requested_memory_kb))
-                # set as hard limit
-                tmpfile.write("ulimit -H -v > /dev/null \n")
-                tmpfile.write("set -e\n")
-
-            if self.shellfile:
-
-                # make sure path exists that we want to write to
-                tmpfile.write("mkdir -p $(dirname \"{}\")\n".format(
-                    self.shellfile))
-
-                # output low-level debugging information to a shell log file
-                tmpfile.write(
-                    'echo "%s : START -> %s" >> %s\n' %
-                    (self.job_name, tmpfilename, self.shellfile))
-                # disabled - problems with quoting
-                # tmpfile.write( '''echo 'statement=%s' >> %s\n''' %
-                # (shellquote(statement), self.shellfile) )
-                tmpfile.write("set | sed 's/^/%s : /' >> %s\n" %
-                              (self.job_name, self.shellfile))
-                tmpfile.write("pwd | sed 's/^/%s : /' >> %s\n" %
-                              (self.job_name, self.shellfile))
-                tmpfile.write("hostname | sed 's/^/%s: /' >> %s\n" %
-                              (self.job_name, self.shellfile))
-                # cat /proc/meminfo is Linux specific
-                if get_params()['os'] == 'Linux':
-                    tmpfile.write("cat /proc/meminfo | sed 's/^/%s: /' >> %s\n" %
-                                  (self.job_name, self.shellfile))
-                elif get_params()['os'] == 'Darwin':
-                    tmpfile.write("vm_stat | sed 's/^/%s: /' >> %s\n" %
-                                  (self.job_name, self.shellfile))
-                tmpfile.write(
-                    'echo "%s : END -> %s" >> %s\n' %
-                    (self.job_name, tmpfilename, self.shellfile))
-                tmpfile.write("ulimit | sed 's/^/%s: /' >> %s\n" %
-                              (self.job_name, self.shellfile))
-
-            job_path = os.path.abspath(tmpfilename)
-
-            tmpfile.write(expanded_statement)
-            tmpfile.write("\n\n")
-            tmpfile.close()
+        os.fchmod(fd, stat.S_IRWXG | stat.S_IRWXU)
+        with os.fdopen(fd, "w") as tmpfile:
+            tmpfile.write("\n".join(lines) + "\n\n")
 
         return statement, job_path
 
@@ -748,6 +1663,7 @@ class GridExecutor(Executor):
             kwargs.get("cluster_queue_manager"),
             self.session,
             ignore_errors=self.ignore_errors)
+        self.max_rss_unit = self.queue_manager.max_rss_unit
 
     def __enter__(self):
         # for cluster execution, the working directory can not be
@@ -768,88 +1684,266 @@ class GridExecutor(Executor):
             self.logger.info("moving files from {} to {}".format(
                 self.work_dir, destdir))
 
-            for root, dirs, files in os.walk(self.work_dir):
-                for d in dirs:
-                    if not os.path.exists(os.path.join(destdir, d)):
-                        os.makedirs(d)
-                for fn in files:
-                    shutil.move(os.path.join(root, fn),
-                                os.path.join(self.work_dir, root, fn))
+            stage_files(self.work_dir, destdir,
+                        threads=self.options.get("staging_threads", 4))
 
             shutil.rmtree(self.work_dir)
 
+    def submit_job(self, jt, statement):
+        """submit *statement* as a job using the job template *jt*.
+
+        Returns a tuple of job id and the paths of the job script
+        and of stdout and stderr.
+        """
+        self.logger.info("running statement:\n%s" % statement)
+
+        full_statement, job_path = self.build_job_script(statement)
+
+        stdout_path, stderr_path = self.queue_manager.set_drmaa_job_paths(
+            jt, job_path)
+
+        throttle = get_submission_throttle()
+        num_jobs = throttle.acquire()
+        try:
+            job_id = self.session.runJob(jt)
+        except Exception:
+            throttle.release(num_jobs)
+            raise
+        # the job stops counting against the limit once it is finished
+        get_job_monitor().watch([job_id])[job_id].rawlink(
+            lambda result, n=num_jobs: throttle.release(n))
+
+        self.logger.info(
+            "job has been submitted with job_id %s" % str(job_id))
+        return job_id, (job_path, stdout_path, stderr_path)
+
     def run(self, statement_list):
 
-        # submit statements to cluster individually.
-        benchmark_data = []
-        jt = self.setup_job(self.options["cluster"])
+        if self.options.get("job_bundle_time",
+                            self.options["cluster"].get("bundle_time", None)):
+            return self.run_bundled(statement_list)
+
+        cluster_options = self.options["cluster"]
+        max_escalations = int(self.options.get(
+            "job_memory_escalations",
+            cluster_options.get("memory_escalations", 0)))
+        escalation_factor = float(self.options.get(
+            "job_memory_escalation_factor",
+            cluster_options.get("memory_escalation_factor", 2)))
+        memory_max = self.options.get(
+            "job_memory_max", cluster_options.get("memory_max", None))
+
+        # submit statements to cluster individually. Statements
+        # failing for lack of memory are resubmitted with more memory.
+        benchmark_data = [None] * len(statement_list)
+        pending = list(range(len(statement_list)))
+        escalations = 0
+        while pending:
+            jt = self.setup_job(self.options["cluster"])
+
+            job_ids, filenames = [], []
+            for index in pending:
+                job_id, paths = self.submit_job(jt, statement_list[index])
+                job_ids.append(job_id)
+                filenames.append(paths)
+
+            self.wait_for_job_completion(job_ids)
+
+            # collect and clean up
+            failed = []
+            for index, job_id, paths in zip(pending, job_ids, filenames):
+                statement = statement_list[index]
+                job_path, stdout_path, stderr_path = paths
+                # TODO: collect timings from individual jobs
+                try:
+                    stdout, stderr, resource_usage = self.queue_manager.collect_single_job_from_cluster(
+                        job_id,
+                        statement,
+                        stdout_path,
+                        stderr_path,
+                        job_path,
+                        job_memory_bytes=self.get_job_memory_bytes())
+                except JobMemoryError as ex:
+                    if escalations >= max_escalations:
+                        raise
+                    self.logger.warning(
+                        "job {} exceeded its memory of {}, will be resubmitted: {}".format(
+                            job_id, self.job_memory, ex))
+                    failed.append(index)
+                    continue
 
-        job_ids, filenames = [], []
-        for statement in statement_list:
-            self.logger.info("running statement:\n%s" % statement)
+                data = self.collect_benchmark_data([statement],
+                                                   resource_usage)
+                for d in data:
+                    d.update({"job_memory": self.job_memory,
+                              "memory_escalations": escalations})
+                benchmark_data[index] = data
+            self.session.deleteJobTemplate(jt)
+
+            if failed and not self.escalate_memory(escalation_factor,
+                                                   memory_max):
+                raise OSError(
+                    "{} jobs exceeded their memory of {}, which can not be "
+                    "increased further".format(len(failed), self.job_memory))
+            pending = failed
+            escalations += 1
 
-            full_statement, job_path = self.build_job_script(statement)
+        return [d for data in benchmark_data for d in data]
 
-            stdout_path, stderr_path = self.queue_manager.set_drmaa_job_paths(
-                jt, job_path)
+    def run_bundled(self, statement_list):
+        """run statements in bundles, each submitted as a single job.
 
-            job_id = self.session.runJob(jt)
+        Statements are packed into bundles targetting a wall time of
+        ``job_bundle_time`` seconds, using the durations in
+        ``job_durations`` or ``job_duration`` seconds for each
+        statement if not given. Within a job, ``job_bundle_parallel``
+        statements are run at a time.
+
+        Exit status and timings are reported for each statement,
+        while other resource usage is that of the whole bundle.
+        """
+        bundle_time = float(self.options.get(
+            "job_bundle_time", self.options["cluster"].get("bundle_time")))
+        parallel = max(1, int(self.options.get("job_bundle_parallel", 1)))
+
+        durations = self.options.get("job_durations", None)
+        if durations is None:
+            durations = [float(self.options.get(
+                "job_duration",
+                self.options["cluster"].get("duration_default", 60)))] * \
+                len(statement_list)
+        elif len(durations) != len(statement_list):
+            raise ValueError(
+                "number of job_durations ({}) and statements ({}) differ".format(
+                    len(durations), len(statement_list)))
+
+        bundles = pack_statements(durations, bundle_time * parallel)
+        self.logger.info("packed %i statements into %i bundles" %
+                         (len(statement_list), len(bundles)))
+
+        # statements of a bundle are stored consecutively
+        order = [x for bundle in bundles for x in bundle]
+        jobsfile = get_temp_filename(dir=self.work_dir,
+                                     clear=True) + ".jobs"
+        indexfile = write_statement_index(
+            [statement_list[x] for x in order], jobsfile)
+
+        if self.ignore_pipe_errors:
+            shell_options = "-eu"
+        else:
+            shell_options = "-eu -o pipefail"
+
+        job_ids, filenames, status_files, jts = [], [], [], []
+        first = 1
+        for bundle in bundles:
+            last = first + len(bundle) - 1
+            status_file = "{}.{}.status".format(jobsfile, first)
+            bundle_statement = (
+                "cgat_run_bundle {} {} {} {} {} {} '{}'".format(
+                    jobsfile, indexfile, first, last, parallel,
+                    status_file, shell_options))
+
+            jt = self.setup_job(
+                self.options["cluster"],
+                job_threads=self.job_threads * min(parallel, len(bundle)))
+            job_id, paths = self.submit_job(jt, bundle_statement)
+            jts.append(jt)
             job_ids.append(job_id)
-            filenames.append((job_path, stdout_path, stderr_path))
-            self.logger.info(
-                "job has been submitted with job_id %s" % str(job_id))
-            # give back control for bulk submission
-            gevent.sleep(GEVENT_TIMEOUT_STARTUP)
+            filenames.append(paths)
+            status_files.append(status_file)
+            first = last + 1
 
         self.wait_for_job_completion(job_ids)
 
-        # collect and clean up
-        for job_id, statement, paths in zip(job_ids,
-                                            statement_list,
-                                            filenames):
+        benchmark_data = [None] * len(statement_list)
+        errors = []
+        first = 1
+        for bundle, job_id, paths, status_file in zip(
+                bundles, job_ids, filenames, status_files):
             job_path, stdout_path, stderr_path = paths
-            # TODO: collect timings from individual jobs
+            num_errors = len(errors)
             stdout, stderr, resource_usage = self.queue_manager.collect_single_job_from_cluster(
-                job_id,
-                statement,
-                stdout_path,
-                stderr_path,
-                job_path)
-
-            benchmark_data.extend(
-                self.collect_benchmark_data([statement],
-                                            resource_usage))
-        self.session.deleteJobTemplate(jt)
+                job_id, "bundle of {} statements".format(len(bundle)),
+                stdout_path, stderr_path, job_path)
+
+            try:
+                with open(status_file) as inf:
+                    status = parse_bundle_status(inf)
+                os.unlink(status_file)
+            except IOError:
+                status = {}
+
+            for task, index in enumerate(bundle, first):
+                statement = statement_list[index]
+                data = self.collect_benchmark_data(
+                    [statement], resource_usage)[0]
+                if task not in status:
+                    errors.append(
+                        "no exit status for statement in job {}: {}".format(
+                            job_id, statement))
+                    benchmark_data[index] = data
+                    continue
+
+                member = status[task]
+                if member["exit_status"] != 0:
+                    errors.append(
+                        "statement in job {} has non-zero exit status {}: {}".format(
+                            job_id, member["exit_status"], statement))
+
+                wall_t = member["end_time"] - member["start_time"]
+                cpu_t = member["user_t"] + member["sys_t"]
+                data.update(member)
+                data.update({
+                    "wall_t": wall_t,
+                    "total_t": wall_t,
+                    "cpu_t": cpu_t,
+                    "percent_cpu": 100.0 * cpu_t / max(1.0, wall_t) / self.job_threads})
+                benchmark_data[index] = data
+
+            if len(errors) > num_errors and stderr:
+                errors.append("stderr of job {} = {}".format(
+                    job_id, "".join(stderr)))
+            first += len(bundle)
+
+        for jt in jts:
+            self.session.deleteJobTemplate(jt)
+
+        for fn in (jobsfile, indexfile):
+            try:
+                os.unlink(fn)
+            except OSError:
+                pass
+
+        if errors:
+            error_msg = "\n".join(errors)
+            if self.ignore_errors:
+                self.logger.warning(error_msg)
+            else:
+                raise OSError(error_msg)
+
         return benchmark_data
 
-    def setup_job(self, options):
+    def setup_job(self, options, job_threads=None):
 
         jt = self.queue_manager.setup_drmaa_job_template(
             self.session,
             job_name=self.job_name,
             job_memory=self.job_memory,
-            job_threads=self.job_threads,
+            job_threads=job_threads or self.job_threads,
             working_directory=self.work_dir,
+            bash_env=self.bash_env,
             **options)
         self.logger.info("job-options: %s" % jt.nativeSpecification)
         return jt
 
     def wait_for_job_completion(self, job_ids):
+        """wait for jobs in *job_ids* to finish.
 
+        Job states are polled by the :class:`JobMonitor` shared by all
+        executors in the session.
+        """
         self.logger.info("waiting for %i jobs to finish " % len(job_ids))
-        running_job_ids = set(job_ids)
-        while running_job_ids:
-            for job_id in list(running_job_ids):
-                status = self.session.jobStatus(job_id)
-                if status in (drmaa.JobState.DONE, drmaa.JobState.FAILED):
-                    running_job_ids.remove(job_id)
-                if status in (drmaa.JobState.RUNNING):
-                    # The drmaa documentation is unclear as to what gets returned
-                    # for a job array when tasks can be in different states
-                    gevent.sleep(self.monitor_interval_running)
-                else:
-                    gevent.sleep(self.monitor_interval_queued)
-                    break
+        get_job_monitor().wait(job_ids)
 
 
 class GridArrayExecutor(GridExecutor):
@@ -861,12 +1955,14 @@ class GridArrayExecutor(GridExecutor):
         jobsfile = get_temp_filename(dir=self.work_dir,
                                      clear=True) + ".jobs"
 
-        with open(jobsfile, "w") as outf:
-            outf.write("\n".join(statement_list))
+        indexfile = write_statement_index(statement_list, jobsfile)
 
         master_statement = (
-            "CMD=$(awk \"NR==$SGE_TASK_ID\" {jobsfile}); "
-            "eval $CMD".format(**locals()))
+            "CMD=$(cgat_get_statement {jobsfile} {indexfile} ${task_id}); "
+            "eval \"$CMD\"".format(
+                jobsfile=jobsfile,
+                indexfile=indexfile,
+                task_id=self.queue_manager.task_id_variable))
 
         full_statement, job_path = self.build_job_script(master_statement)
 
@@ -882,10 +1978,11 @@ class GridArrayExecutor(GridExecutor):
         benchmark_data.extend(
             self.collect_benchmark_data(statement_list,
                                         resource_usage=resource_usage))
-        try:
-            os.unlink(jobsfile)
-        except OSError:
-            pass
+        for fn in (jobsfile, indexfile):
+            try:
+                os.unlink(fn)
+            except OSError:
+                pass
 
         return benchmark_data
 
@@ -901,12 +1998,17 @@ class GridArrayExecutor(GridExecutor):
 
         logger.info("job submitted with %s" % jt.nativeSpecification)
 
-        # sge works with 1-based, closed intervals
-        job_ids = session.runBulkJobs(jt, start + 1, end, increment)
-        logger.info("%i array jobs have been submitted as job_id %s" %
-                    (len(job_ids), job_ids[0]))
+        throttle = get_submission_throttle()
+        num_jobs = throttle.acquire(len(range(start, end, increment)))
+        try:
+            # sge works with 1-based, closed intervals
+            job_ids = session.runBulkJobs(jt, start + 1, end, increment)
+            logger.info("%i array jobs have been submitted as job_id %s" %
+                        (len(job_ids), job_ids[0]))
 
-        self.wait_for_job_completion(job_ids)
+            self.wait_for_job_completion(job_ids)
+        finally:
+            throttle.release(num_jobs)
 
         logger.info("%i array jobs for job_id %s have completed" %
                     (len(job_ids), job_ids[0]))
@@ -923,90 +2025,314 @@ class GridArrayExecutor(GridExecutor):
         return job_id, stdout, stderr, resource_usage
 
 
+class ProcessTreeSampler(threading.Thread):
+    """sample resource usage of a process and all its descendants.
+
+    The sampler polls ``/proc`` every *interval* seconds and records
+    the resident set size (kb), CPU usage (percent), bytes read and
+    written and the number of threads and processes of the process
+    tree rooted at *pid*. Samples are written as tab-separated values
+    to *filename*.
+
+    This is only available on systems providing a ``/proc`` file
+    system.
+    """
+
+    header = ("time", "rss", "percent_cpu", "read_bytes", "write_bytes",
+              "threads", "processes")
+
+    def __init__(self, pid, interval, filename):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pid = pid
+        self.interval = interval
+        self.filename = filename
+        self.stopped = threading.Event()
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.samples = []
+
+    @staticmethod
+    def is_available():
+        return os.path.exists("/proc/self/stat")
+
+    def read_stat(self, pid):
+        """return a tuple of (ppid, cpu ticks, threads, rss in kb)."""
+        with open("/proc/{}/stat".format(pid)) as inf:
+            data = inf.read()
+        # the command name in parentheses might contain spaces
+        fields = data[data.rindex(")") + 2:].split()
+        return (int(fields[1]),
+                int(fields[11]) + int(fields[12]),
+                int(fields[17]),
+                int(fields[21]) * self.page_size // 1024)
+
+    def read_io(self, pid):
+        """return a tuple of (read_bytes, write_bytes)."""
+        read_bytes, write_bytes = 0, 0
+        try:
+            with open("/proc/{}/io".format(pid)) as inf:
+                for line in inf:
+                    if line.startswith("read_bytes"):
+                        read_bytes = int(line.split()[1])
+                    elif line.startswith("write_bytes"):
+                        write_bytes = int(line.split()[1])
+        except (IOError, OSError):
+            pass
+        return read_bytes, write_bytes
+
+    def collect(self):
+        """return aggregate statistics for the process tree."""
+        stats, children = {}, collections.defaultdict(list)
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                stat = self.read_stat(entry)
+            except (IOError, OSError, ValueError, IndexError):
+                continue
+            stats[int(entry)] = stat
+            children[stat[0]].append(int(entry))
+
+        ticks, threads, rss, read_bytes, write_bytes, processes = 0, 0, 0, 0, 0, 0
+        todo = [self.pid]
+        while todo:
+            pid = todo.pop()
+            if pid not in stats:
+                continue
+            ppid, t, nthreads, r = stats[pid]
+            ticks += t
+            threads += nthreads
+            rss += r
+            rb, wb = self.read_io(pid)
+            read_bytes += rb
+            write_bytes += wb
+            processes += 1
+            todo.extend(children[pid])
+
+        return ticks, rss, read_bytes, write_bytes, threads, processes
+
+    def run(self):
+        start_time = last_time = time.time()
+        last_ticks = 0
+        with open(self.filename, "w") as outf:
+            outf.write("\t".join(self.header) + "\n")
+            while True:
+                ticks, rss, read_bytes, write_bytes, threads, processes = self.collect()
+                now = time.time()
+                if processes > 0:
+                    percent_cpu = 100.0 * max(0, ticks - last_ticks) / \
+                        self.clock_ticks / max(now - last_time, 0.001)
+                    sample = (now - start_time, rss, percent_cpu,
+                              read_bytes, write_bytes, threads, processes)
+                    self.samples.append(sample)
+                    outf.write("%.2f\t%i\t%.1f\t%i\t%i\t%i\t%i\n" % sample)
+                    last_ticks, last_time = ticks, now
+                if self.stopped.wait(self.interval):
+                    break
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def get_summary(self):
+        """return peak and mean values of the sampled metrics."""
+        if not self.samples:
+            return {"sampled_max_rss": 0,
+                    "sampled_mean_rss": 0,
+                    "sampled_max_percent_cpu": 0,
+                    "sampled_mean_percent_cpu": 0,
+                    "sampled_max_threads": 0,
+                    "sampled_read_bytes": 0,
+                    "sampled_write_bytes": 0,
+                    "sampled_metrics_file": self.filename}
+
+        columns = list(zip(*self.samples))
+        n = float(len(self.samples))
+        return {"sampled_max_rss": max(columns[1]),
+                "sampled_mean_rss": sum(columns[1]) / n,
+                "sampled_max_percent_cpu": max(columns[2]),
+                "sampled_mean_percent_cpu": sum(columns[2]) / n,
+                "sampled_max_threads": max(columns[5]),
+                "sampled_read_bytes": max(columns[3]),
+                "sampled_write_bytes": max(columns[4]),
+                "sampled_metrics_file": self.filename}
+
+
 class LocalExecutor(Executor):
 
-    def collect_metric_data(self, process, start_time, end_time, time_data_file):
+    def collect_metric_data(self, process, start_time, end_time, rusage):
+        """collect job metrics from the resource usage of a process
+        as returned by :func:`os.wait4`.
+
+        The resource usage includes all children of the process that
+        have been waited for.
+        """
         data = {"start_time": start_time,
                 "end_time": end_time,
                 "submission_time": start_time,
                 "hostname": socket.gethostname(),
                 "total_t": end_time - start_time}
 
-        if time_data_file is not None and os.path.exists(time_data_file):
-            with open(time_data_file) as inf:
-                pairs = [x[:-1].split("\t") for x in inf if x]
+        if rusage is not None:
+            # ru_maxrss is in kilobytes on Linux, but in bytes on OS X
+            max_rss = rusage.ru_maxrss
+            if sys.platform == "darwin":
+                max_rss = max_rss / 1024.0
 
-            def _convert(key, v):
-                return iotools.str2val(v)
+            wall_t = end_time - start_time
+            cpu_t = rusage.ru_utime + rusage.ru_stime
 
-            # remove any non-key-value pairs
-            data.update(dict([(x[0], _convert(x[0], x[1]))
-                              for x in pairs if len(x) == 2]))
-
-            # remove % sign
-            data.update(
-                {"percent_cpu": int(re.sub("%", "", data.get("percent_cpu", 0))),
-                 "cpu_t": float(data["user_t"]) + float(data["sys_t"])})
+            # max_vmem is set to max_rss, not available from rusage
+            data.update({
+                "exit_status": process.returncode,
+                "user_t": rusage.ru_utime,
+                "sys_t": rusage.ru_stime,
+                "cpu_t": cpu_t,
+                "wall_t": wall_t,
+                "percent_cpu": 100.0 * cpu_t / max(wall_t, 0.001),
+                "shared_data": rusage.ru_ixrss,
+                "unshared_data": rusage.ru_idrss,
+                "average_uss": rusage.ru_isrss,
+                "average_memory_total": rusage.ru_ixrss + rusage.ru_idrss + rusage.ru_isrss,
+                "io_input": rusage.ru_inblock,
+                "io_output": rusage.ru_oublock,
+                "max_rss": max_rss,
+                "max_vmem": max_rss,
+                "minor_page_faults": rusage.ru_minflt,
+                "major_page_faults": rusage.ru_majflt,
+                "swapped": rusage.ru_nswap,
+                "context_switches_involuntarily": rusage.ru_nivcsw,
+                "context_switches_voluntarily": rusage.ru_nvcsw,
+                "signal": rusage.ru_nsignals,
+                "socket_received": rusage.ru_msgrcv,
+                "socket_sent": rusage.ru_msgsnd})
 
         return JobInfo(jobId=process.pid, resourceUsage=data)
 
-    def run(self, statement_list):
+    def wait_for_process(self, process):
+        """read the output of *process* and wait for it to finish.
 
-        benchmark_data = []
-        for statement in statement_list:
-            self.logger.info("running statement:\n%s" % statement)
-
-            full_statement, job_path = self.build_job_script(statement)
-
-            # max_vmem is set to max_rss, not available by /usr/bin/time
-            full_statement = (
-                "\\time --output=%s.times "
-                "-f '"
-                "exit_status\t%%x\n"
-                "user_t\t%%U\n"
-                "sys_t\t%%S\n"
-                "wall_t\t%%e\n"
-                "shared_data\t%%D\n"
-                "io_input\t%%I\n"
-                "io_output\t%%O\n"
-                "average_memory_total\t%%K\n"
-                "percent_cpu\t%%P\n"
-                "average_rss\t%%t\n"
-                "max_rss\t%%M\n"
-                "max_vmem\t%%M\n"
-                "minor_page_faults\t%%R\n"
-                "swapped\t%%W\n"
-                "context_switches_involuntarily\t%%c\n"
-                "context_switches_voluntarily\t%%w\n"
-                "average_uss\t%%p\n"
-                "signal\t%%k\n"
-                "socket_received\t%%r\tn"
-                "socket_sent\t%%s\n"
-                "major_page_fault\t%%F\n"
-                "unshared_data\t%%D\n' "
-                "%s") % (job_path, job_path)
+        The process is reaped with :func:`os.wait4` in order to obtain
+        the resource usage of the process and its children without
+        requiring an external tool such as ``/usr/bin/time``.
+
+        Returns a tuple of stdout, stderr and resource usage.
+        """
+        output = {}
+
+        def _read(name, stream):
+            output[name] = stream.read()
+            stream.close()
+
+        readers = [threading.Thread(target=_read, args=(name, stream))
+                   for name, stream in (("stdout", process.stdout),
+                                        ("stderr", process.stderr))]
+        for reader in readers:
+            reader.start()
+        process.stdin.close()
+
+        pid, status, rusage = os.wait4(process.pid, 0)
+
+        for reader in readers:
+            reader.join()
+
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+
+        return output["stdout"], output["stderr"], rusage
+
+    def get_parallel_jobs(self, num_statements):
+        """return the number of statements to run concurrently.
+
+        The number of concurrent jobs is limited by the number of
+        cores available to local jobs divided by ``job_threads`` and by
+        the memory available to local jobs divided by the total memory
+        requested per job. If ``job_parallel`` is an integer, it sets
+        an additional upper limit.
+
+        Jobs are additionally admitted through the global
+        :class:`AdmissionController`, which accounts for jobs from
+        other tasks that run at the same time.
+        """
+        controller = get_admission_controller()
+        max_jobs = max(1, controller.cores // max(1, self.job_threads))
+
+        job_memory = self.get_job_memory_bytes()
+        if job_memory > 0:
+            max_jobs = min(max_jobs, max(1, controller.memory // job_memory))
+
+        job_parallel = self.options.get("job_parallel", False)
+        if job_parallel is not True:
+            max_jobs = min(max_jobs, int(job_parallel))
+
+        return max(1, min(max_jobs, num_statements))
+
+    def start_sampler(self, process, job_path):
+        """start sampling the resource usage of *process*.
 
+        Sampling is enabled by setting ``local_sampling_interval``
+        to the sampling interval in seconds. The samples are written
+        to ``local_sampling_dir`` or, if not set, next to the job
+        script with the suffix ``.metrics.tsv``.
+
+        Returns None if sampling is not enabled.
+        """
+        interval = self.options.get("local_sampling_interval", None)
+        if not interval:
+            return None
+
+        if not ProcessTreeSampler.is_available():
+            self.logger.warn("process sampling is not available on this system")
+            return None
+
+        sampling_dir = self.options.get("local_sampling_dir", None)
+        if sampling_dir:
+            if not os.path.exists(sampling_dir):
+                os.makedirs(sampling_dir, exist_ok=True)
+            filename = os.path.join(sampling_dir,
+                                    os.path.basename(job_path) + ".metrics.tsv")
+        else:
+            filename = job_path + ".metrics.tsv"
+
+        sampler = ProcessTreeSampler(process.pid, float(interval), filename)
+        sampler.start()
+        return sampler
+
+    def run_statement(self, statement):
+
+        self.logger.info("running statement:\n%s" % statement)
+
+        full_statement, job_path = self.build_job_script(statement)
+
+        with self.admit_job():
             while 1:
                 start_time = time.time()
 
-                os.environ.update(
-                    {'BASH_ENV': os.path.join(os.environ['HOME'], '.bashrc')})
+                env = os.environ.copy()
+                env["BASH_ENV"] = self.bash_env
                 process = subprocess.Popen(
-                    full_statement,
+                    job_path,
                     cwd=self.work_dir,
                     shell=True,
                     stdin=subprocess.PIPE,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
-                    env=os.environ.copy(),
+                    env=env,
                     close_fds=True,
                     executable="/bin/bash")
 
-                # process.stdin.close()
-                stdout, stderr = process.communicate()
+                sampler = self.start_sampler(process, job_path)
+
+                stdout, stderr, rusage = self.wait_for_process(process)
 
                 end_time = time.time()
 
+                if sampler:
+                    sampler.stop()
+
                 if process.returncode == 126:
                     self.logger.warn(
                         "repeating execution: message={}".format(stderr))
@@ -1014,35 +2340,58 @@ class LocalExecutor(Executor):
                     continue
 
                 break
-            stdout = stdout.decode("utf-8")
-            stderr = stderr.decode("utf-8")
+        stdout = stdout.decode("utf-8")
+        stderr = stderr.decode("utf-8")
 
-            if process.returncode != 0 and not self.ignore_errors:
-                raise OSError(
-                    "---------------------------------------\n"
-                    "Child was terminated by signal %i: \n"
-                    "The stderr was: \n%s\n%s\n"
-                    "-----------------------------------------" %
-                    (-process.returncode, stderr, statement))
-
-            resource_usage = self.collect_metric_data(process,
-                                                      start_time,
-                                                      end_time,
-                                                      time_data_file=job_path + ".times")
-
-            benchmark_data.extend(
-                self.collect_benchmark_data(
-                    [statement],
-                    resource_usage=[resource_usage]))
+        if process.returncode != 0 and not self.ignore_errors:
+            raise OSError(
+                "---------------------------------------\n"
+                "Child was terminated by signal %i: \n"
+                "The stderr was: \n%s\n%s\n"
+                "-----------------------------------------" %
+                (-process.returncode, stderr, statement))
 
-            try:
-                os.unlink(job_path)
-                os.unlink(job_path + ".times")
-            except OSError:
-                pass
+        resource_usage = self.collect_metric_data(process,
+                                                  start_time,
+                                                  end_time,
+                                                  rusage)
+
+        if sampler:
+            resource_usage.resourceUsage.update(sampler.get_summary())
+
+        benchmark_data = self.collect_benchmark_data(
+            [statement],
+            resource_usage=[resource_usage])
+
+        try:
+            os.unlink(job_path)
+        except OSError:
+            pass
 
         return benchmark_data
 
+    def run(self, statement_list):
+
+        num_jobs = 1
+        if self.options.get("job_parallel", False):
+            num_jobs = self.get_parallel_jobs(len(statement_list))
+
+        if num_jobs == 1:
+            benchmark_data = [self.run_statement(statement)
+                              for statement in statement_list]
+        else:
+            self.logger.info("running {} statements with {} concurrent jobs".format(
+                len(statement_list), num_jobs))
+            pool = ThreadPool(num_jobs)
+            try:
+                # map returns results in submission order
+                benchmark_data = pool.map(self.run_statement, statement_list)
+            finally:
+                pool.close()
+                pool.join()
+
+        return [x for data in benchmark_data for x in data]
+
 
 class LocalArrayExecutor(LocalExecutor):
     pass
@@ -1102,6 +2451,37 @@ def run(statement, **kwargs):
     job_array
         if set, run statement as an array job. Job_array should be
         tuple with start, end, and increment.
+    job_parallel
+        if set, run a list of statements concurrently when executing
+        locally. The number of concurrent jobs is limited by the
+        number of cores and the memory of the host given `job_threads`
+        and `job_memory`. If set to an integer, it is an upper bound
+        on the number of concurrent jobs. Benchmark data is returned
+        in the order of the statements.
+    job_bundle_time
+        if set, pack a list of statements into cluster jobs that each
+        run for about this many seconds. The durations of statements
+        can be given as a list in `job_durations` or for all statements
+        in `job_duration`, otherwise the cluster option
+        `duration_default` is used.
+    job_bundle_parallel
+        number of statements to run at a time within a bundle. The
+        threads requested for the job are scaled accordingly.
+    stage_in
+        filename or list of filenames to copy to node-local scratch
+        space (``$TMPDIR``) before running the statement. Occurrences
+        in the statement are replaced with the local copy.
+    stage_out
+        filename or list of filenames that the statement writes to
+        node-local scratch space and that are copied back once the
+        statement has completed successfully.
+    job_memory_escalations
+        number of times a job that was terminated for exceeding its
+        memory on the cluster is resubmitted. Each time, the memory is
+        increased by `job_memory_escalation_factor` up to a total of
+        `job_memory_max`. Defaults to the cluster options
+        `memory_escalations`, `memory_escalation_factor` and
+        `memory_max`.
 
     In addition, any additional variables will be used to interpolate
     the command line string using python's '%' string interpolation
@@ -1233,8 +2613,14 @@ def run(statement, **kwargs):
     # execute statement list
     runner = make_runner(**options)
     with runner as r:
+        if options.get("metrics_auto_size", False):
+            r.size_from_metrics(statement_list)
         benchmark_data = r.run(statement_list)
 
+    store = get_metrics_store()
+    if store is not None:
+        store.add(benchmark_data, max_rss_unit=runner.max_rss_unit)
+
     # log benchmark_data
     for data in benchmark_data:
         logger.info(json.dumps(data))
@@ -1260,6 +2646,10 @@ def submit(module,
     :func:`run` method in this module thus providing the same
     control options as for command line tools.
 
+    If warm workers have been configured (see
+    :mod:`cgatcore.pipeline.worker`), the function is run in a
+    worker instead and the job options are ignored.
+
     Arguments
     ---------
     module : string
@@ -1285,6 +2675,26 @@ def submit(module,
     if not job_memory:
         job_memory = get_params().get("cluster_memory_default", "2G")
 
+    pool = get_worker_pool()
+    if pool is not None:
+        # use the calling conventions of run_function
+        def unpack(x):
+            if type(x) in (list, tuple) and len(x) == 1:
+                return x[0]
+            return x
+
+        if infiles and outfiles and args:
+            call_args = [unpack(infiles), unpack(outfiles), list(args)]
+        elif infiles and outfiles:
+            call_args = [unpack(infiles), unpack(outfiles)]
+        elif args:
+            call_args = [list(args)]
+        else:
+            raise ValueError(
+                "Expecting infile+outfile+params or infile+outfile or params")
+        pool.call(module, function, args=call_args)
+        return
+
     if type(infiles) in (list, tuple):
         infiles = " ".join(["--input=%s" % x for x in infiles])
     else:
@@ -5,8 +5,13 @@ Reference
 ---------
 
 """
+import hashlib
+import logging
 import os
+import shutil
 import tempfile
+import time
+from multiprocessing.pool import ThreadPool
 
 import cgatcore.iotools as iotools
 import cgatcore.experiment as E
@@ -157,3 +162,127 @@ def check_scripts(filenames):
 
     if missing:
         raise ValueError("missing scripts: %s" % ",".join(missing))
+
+
+def get_logger():
+    return logging.getLogger("cgatcore.pipeline")
+
+
+def copy_with_checksum(src, dest, blocksize=2 ** 20):
+    """copy file *src* to *dest* and verify the copy.
+
+    The copy is written to a temporary file next to *dest* that is
+    renamed once its size and md5 checksum have been verified.
+
+    Returns the number of bytes copied.
+    """
+    tmp_dest = dest + ".staging"
+    checksum = hashlib.md5()
+    with open(src, "rb") as inf, open(tmp_dest, "wb") as outf:
+        while True:
+            block = inf.read(blocksize)
+            if not block:
+                break
+            checksum.update(block)
+            outf.write(block)
+
+    size = os.path.getsize(src)
+    copy_checksum = hashlib.md5()
+    with open(tmp_dest, "rb") as inf:
+        while True:
+            block = inf.read(blocksize)
+            if not block:
+                break
+            copy_checksum.update(block)
+
+    if os.path.getsize(tmp_dest) != size or \
+       copy_checksum.digest() != checksum.digest():
+        os.unlink(tmp_dest)
+        raise OSError("verification of copy from {} to {} failed".format(
+            src, dest))
+
+    shutil.copystat(src, tmp_dest)
+    os.replace(tmp_dest, dest)
+    return size
+
+
+def stage_files(src_dir, dest_dir, move=True, threads=4):
+    """stage all files in *src_dir* to *dest_dir*, keeping the
+    directory structure.
+
+    Files are renamed if source and destination are on the same file
+    system. Otherwise they are copied with *threads* files at a time
+    and each copy is verified by size and checksum, see
+    :func:`copy_with_checksum`.
+
+    Arguments
+    ---------
+    src_dir : string
+        Directory to stage files from.
+    dest_dir : string
+        Directory to stage files to.
+    move : bool
+        If set, files are moved, otherwise they are copied.
+    threads : int
+        Number of files to copy at a time.
+
+    Returns
+    -------
+    stats : dict
+        Dictionary with the number of files renamed and copied, the
+        bytes copied and the time taken in seconds.
+    """
+    start_time = time.time()
+
+    files = []
+    for root, dirs, filenames in os.walk(src_dir):
+        dest_root = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+        if not os.path.exists(dest_root):
+            os.makedirs(dest_root)
+        for fn in filenames:
+            files.append((os.path.join(root, fn), os.path.join(dest_root, fn)))
+
+    same_device = move and \
+        os.stat(src_dir).st_dev == os.stat(dest_dir).st_dev
+
+    stats = {"renamed": 0, "copied": 0, "bytes": 0}
+    to_copy = []
+    for src, dest in files:
+        if same_device and not os.path.islink(src):
+            os.replace(src, dest)
+            stats["renamed"] += 1
+        elif os.path.islink(src):
+            if os.path.lexists(dest):
+                os.unlink(dest)
+            os.symlink(os.readlink(src), dest)
+            if move:
+                os.unlink(src)
+            stats["copied"] += 1
+        else:
+            to_copy.append((src, dest))
+
+    def _copy(args):
+        src, dest = args
+        size = copy_with_checksum(src, dest)
+        if move:
+            os.unlink(src)
+        return size
+
+    if to_copy:
+        pool = ThreadPool(max(1, min(threads, len(to_copy))))
+        try:
+            sizes = pool.map(_copy, to_copy)
+        finally:
+            pool.close()
+            pool.join()
+        stats["copied"] += len(sizes)
+        stats["bytes"] += sum(sizes)
+
+    stats["seconds"] = time.time() - start_time
+    get_logger().info(
+        "staged files from {} to {}: {} renamed, {} copied, "
+        "{:.1f} Mb in {:.1f}s ({:.1f} Mb/s)".format(
+            src_dir, dest_dir, stats["renamed"], stats["copied"],
+            stats["bytes"] / 2 ** 20, stats["seconds"],
+            stats["bytes"] / 2 ** 20 / max(stats["seconds"], 0.001)))
+    return stats
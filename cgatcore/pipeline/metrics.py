@@ -0,0 +1,239 @@
+"""metrics.py - Persistent job metrics for ruffus pipelines
+==========================================================
+
+This module stores the resource usage of jobs in an sqlite database
+so that resources of later jobs can be sized from their history.
+
+Jobs are identified by the task name and a fingerprint of their
+statement (see :func:`get_statement_fingerprint`) that ignores
+filenames and numbers, so that the same command applied to different
+inputs shares its history.
+
+Reference
+---------
+
+"""
+
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from cgatcore.pipeline.parameters import get_params
+
+# global metrics store
+GLOBAL_METRICS_STORE = None
+
+# columns stored for each job
+METRICS_COLUMNS = (
+    ("task", "TEXT"),
+    ("fingerprint", "TEXT"),
+    ("statement", "TEXT"),
+    ("job_id", "TEXT"),
+    ("engine", "TEXT"),
+    ("time", "REAL"),
+    ("slots", "REAL"),
+    ("exit_status", "REAL"),
+    ("wall_t", "REAL"),
+    ("cpu_t", "REAL"),
+    ("max_rss_bytes", "REAL"))
+
+
+def get_statement_fingerprint(statement):
+    """return a fingerprint of a command line statement.
+
+    Tokens that look like paths or filenames are replaced by a
+    placeholder, as are numbers and whitespace is normalized.
+    """
+    tokens = []
+    for token in statement.split():
+        if "/" in token or re.search(r"\w\.\w", token):
+            token = "<file>"
+        else:
+            token = re.sub(r"\d+", "<n>", token)
+        tokens.append(token)
+    return hashlib.md5(" ".join(tokens).encode("utf-8")).hexdigest()
+
+
+class MetricsStore(object):
+    """an sqlite database of job resource usage.
+
+    Arguments
+    ---------
+    filename : string
+        Filename of the database. It is created if it does not exist.
+    history : int
+        Number of most recent jobs of a task and fingerprint to take
+        into account when computing resource usage.
+    """
+
+    def __init__(self, filename, history=10):
+        self.filename = filename
+        self.history = history
+        # jobs may finish in several threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, timeout=30,
+                                          check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS job_metrics ({})".format(
+                ", ".join(["{} {}".format(*x) for x in METRICS_COLUMNS])))
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS job_metrics_task "
+            "ON job_metrics (task, fingerprint)")
+        self.connection.commit()
+
+    def add(self, benchmark_data, max_rss_unit=1024):
+        """add benchmark data of jobs to the store.
+
+        Arguments
+        ---------
+        benchmark_data : list
+            List of dictionaries as returned by
+            :meth:`Executor.run`.
+        max_rss_unit : int
+            Size of the unit of ``max_rss`` in bytes.
+        """
+        now = time.time()
+        rows = []
+        for data in benchmark_data:
+            statement = data.get("statement", "")
+
+            def get_float(key):
+                try:
+                    return float(data.get(key, None))
+                except (TypeError, ValueError):
+                    return None
+
+            max_rss = get_float("max_rss")
+            if max_rss is not None:
+                max_rss *= max_rss_unit
+            rows.append((data.get("task", "unknown"),
+                         get_statement_fingerprint(statement),
+                         statement,
+                         str(data.get("job_id", "")),
+                         data.get("engine", ""),
+                         now,
+                         get_float("slots"),
+                         get_float("exit_status"),
+                         get_float("wall_t"),
+                         get_float("cpu_t"),
+                         max_rss))
+
+        with self.lock:
+            self.connection.executemany(
+                "INSERT INTO job_metrics VALUES ({})".format(
+                    ", ".join(["?"] * len(METRICS_COLUMNS))),
+                rows)
+            self.connection.commit()
+
+    def get_usage(self, task, statements):
+        """return the peak resource usage of previous jobs.
+
+        Resource usage is computed across the most recent successful
+        jobs with the same task name and the same fingerprint as any
+        of *statements*.
+
+        Returns
+        -------
+        usage : dict
+            Dictionary with the number of jobs (``jobs``), the peak
+            resident set size in bytes (``max_rss_bytes``), the peak
+            wall clock time in seconds (``wall_t``) and the peak number
+            of cores used (``cores``). None if there is no history.
+        """
+        fingerprints = set([get_statement_fingerprint(x) for x in statements])
+        rows = []
+        with self.lock:
+            for fingerprint in fingerprints:
+                rows.extend(self.connection.execute(
+                    "SELECT max_rss_bytes, wall_t, cpu_t FROM job_metrics "
+                    "WHERE task = ? AND fingerprint = ? AND "
+                    "(exit_status IS NULL OR exit_status = 0) "
+                    "ORDER BY time DESC LIMIT ?",
+                    (task, fingerprint, self.history)).fetchall())
+
+        if not rows:
+            return None
+
+        return {"jobs": len(rows),
+                "max_rss_bytes": max([x[0] or 0 for x in rows]),
+                "wall_t": max([x[1] or 0 for x in rows]),
+                "cores": max([(x[2] or 0) / max(1.0, x[1] or 0) for x in rows])}
+
+    def close(self):
+        self.connection.close()
+
+
+def get_metrics_store():
+    """return the global metrics store.
+
+    The store is opened on first use from the configuration value
+    ``metrics_database``, a filename relative to the working
+    directory. Returns None if ``metrics_database`` is not set.
+    """
+    global GLOBAL_METRICS_STORE
+
+    if GLOBAL_METRICS_STORE is None:
+        params = get_params()
+        filename = params.get("metrics_database", None)
+        if not filename:
+            return None
+        filename = os.path.join(params["work_dir"], filename)
+        GLOBAL_METRICS_STORE = MetricsStore(
+            filename,
+            history=params.get("metrics_history", 10))
+    return GLOBAL_METRICS_STORE
+
+
+def get_job_resources(usage, job_threads, memory_margin=1.5,
+                      runtime_margin=1.5, queues=None):
+    """compute job resources from historical resource usage.
+
+    Arguments
+    ---------
+    usage : dict
+        Resource usage as returned by :meth:`MetricsStore.get_usage`.
+    job_threads : int
+        Number of threads requested for the job. The number of threads
+        is never increased.
+    memory_margin : float
+        Factor applied to the peak resident set size.
+    runtime_margin : float
+        Factor applied to the peak runtime.
+    queues : dict
+        Dictionary mapping queue names to their maximum runtime in
+        seconds. If given, the queue with the shortest maximum runtime
+        that fits the job is selected.
+
+    Returns
+    -------
+    resources : dict
+        Dictionary with ``job_threads``, ``job_memory`` (per thread)
+        and optionally ``job_queue``.
+    """
+    resources = {}
+
+    threads = max(1, min(job_threads,
+                         int(math.ceil(usage["cores"] * runtime_margin))))
+    resources["job_threads"] = threads
+
+    if usage["max_rss_bytes"]:
+        # round up to full megabytes
+        memory = int(math.ceil(
+            usage["max_rss_bytes"] * memory_margin / threads / 2 ** 20))
+        resources["job_memory"] = "{}M".format(max(1, memory))
+
+    if queues:
+        runtime = usage["wall_t"] * runtime_margin
+        fitting = sorted([(limit, queue) for queue, limit in queues.items()
+                          if limit >= runtime])
+        if fitting:
+            resources["job_queue"] = fitting[0][1]
+        else:
+            resources["job_queue"] = max(
+                [(limit, queue) for queue, limit in queues.items()])[1]
+
+    return resources
@@ -85,8 +85,17 @@ HARDCODED_PARAMS = {
         'queue': 'all.q',
         # priority of jobs in cluster queue
         'priority': -10,
-        # number of jobs to submit to cluster queue
+        # maximum number of jobs queued or running on the cluster
         'num_jobs': 100,
+        # number of job submissions per second
+        'submission_rate': 10,
+        # number of job submissions that can be made in quick succession
+        'submission_burst': 20,
+        # if set, pack statements into jobs running for about
+        # this many seconds
+        'bundle_time': None,
+        # estimated duration of a statement in seconds for bundling
+        'duration_default': 60,
         # name of consumable resource to use for requesting memory
         'memory_resource': "mem_free",
         # amount of memory set by default for each job
@@ -94,6 +103,13 @@ HARDCODED_PARAMS = {
         # ensure requested memory is not exceeded via ulimit (this is
         # not compatible with and/or needed  for all cluster configurations)
         'memory_ulimit': False,
+        # number of times jobs terminated for exceeding their memory
+        # are resubmitted, each time with memory increased by
+        # memory_escalation_factor
+        'memory_escalations': 2,
+        'memory_escalation_factor': 2,
+        # maximum total memory of a job after escalation, for example 256G
+        'memory_max': None,
         # general cluster options
         'options': "",
         # parallel environment to use for multi-threaded jobs
@@ -106,6 +122,64 @@ HARDCODED_PARAMS = {
         # if set to False, the general "tmpdir" parameter is used.
         'tmpdir': False
     },
+    # resources available to jobs running on the local host. If
+    # unset, all cores and the physical memory of the host are used.
+    'local': {
+        # number of cores
+        'cores': None,
+        # amount of memory, for example 64G
+        'memory': None,
+        # interval in seconds for sampling the resource usage of
+        # running jobs. If unset, jobs are not sampled.
+        'sampling_interval': None,
+        # directory for sampled metrics. If unset, metrics are
+        # written next to the job script.
+        'sampling_dir': None
+    },
+    # staging of results from shared temporary directories
+    'staging': {
+        # number of files to copy at a time between file systems
+        'threads': 4
+    },
+    # environment of jobs
+    'environment': {
+        # shell initialisation file sourced by jobs
+        'init': '~/.bashrc',
+        # if set, capture the environment after sourcing the
+        # initialisation file and activating job_condaenv once per
+        # session and let jobs source the captured environment
+        # instead of the initialisation file
+        'snapshot': False
+    },
+    # warm python workers for functions run with P.submit and
+    # cluster_runnable, see cgatcore.pipeline.worker
+    'workers': {
+        # number of workers to start on the local host. If 0 and
+        # spool_dir is unset, functions are run as jobs.
+        'local': 0,
+        # spool directory of workers started elsewhere, for example
+        # within a cluster allocation
+        'spool_dir': None,
+        # seconds after which idle workers exit
+        'idle_timeout': 600
+    },
+    # persistent store of job resource usage
+    'metrics': {
+        # sqlite database in the working directory. If unset,
+        # resource usage is not stored.
+        'database': 'cgat_metrics.db',
+        # number of most recent jobs to size resources from
+        'history': 10,
+        # if set, size job_memory, job_threads and the queue of jobs
+        # from the resource usage of previous jobs
+        'auto_size': False,
+        # factors applied to the peak memory and runtime
+        'memory_margin': 1.5,
+        'runtime_margin': 1.5,
+        # mapping of queue names to their maximum runtime in seconds
+        # to select a queue from, for example {'short.q': 3600}
+        'queues': {}
+    },
     # ruffus job limits for databases
     'jobs_limit_db': 10,
     # ruffus job limits for R
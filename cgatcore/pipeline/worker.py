@@ -0,0 +1,442 @@
+"""worker.py - Warm python workers for pipeline functions
+=========================================================
+
+Functions submitted with :func:`cgatcore.pipeline.submit` or decorated
+with :func:`cgatcore.pipeline.cluster_runnable` are run by starting
+:mod:`cgatcore.pipeline.run_function` in a new python process, which
+imports cgatcore and reads the configuration for every call. This
+module provides worker processes that import cgatcore once and then
+run function calls read from a shared spool directory.
+
+Workers are started on the local host by the pipeline if the
+configuration value ``workers_local`` is set. Alternatively, they can
+be started elsewhere, for example within a long-running cluster
+allocation, from the working directory of the pipeline::
+
+    python -c "import cgatcore.pipeline.worker as w; w.main()" \\
+        --spool-dir=/shared/spool
+
+and used by setting ``workers_spool_dir`` to the same directory.
+
+The spool directory contains the following sub-directories:
+
+``queue``
+    Pickled function calls waiting to be run.
+``running``
+    Function calls claimed by a worker.
+``done``
+    Pickled results of function calls.
+``workers``
+    Heartbeat files of running workers.
+
+Note that modules are imported only once per worker, so changes to a
+module while a pipeline is running are not seen by running workers.
+
+Reference
+---------
+
+"""
+
+import importlib
+import logging
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+import gevent
+
+import cgatcore.experiment as E
+from cgatcore.pipeline.parameters import get_params, get_parameters
+
+# global pool of workers
+GLOBAL_WORKER_POOL = None
+
+# lock for starting the global pool of workers
+GLOBAL_WORKER_POOL_LOCK = threading.Lock()
+
+# sub-directories of the spool directory
+SPOOL_DIRECTORIES = ("queue", "running", "done", "workers")
+
+# interval in seconds between heartbeats of workers
+HEARTBEAT_INTERVAL = 5
+
+# longest interval in seconds between polling the spool directory
+MAX_POLL_INTERVAL = 0.5
+
+
+def get_logger():
+    return logging.getLogger("cgatcore.pipeline")
+
+
+def setup_spool_directory(spool_dir):
+    """create the sub-directories of a spool directory."""
+    for subdir in SPOOL_DIRECTORIES:
+        path = os.path.join(spool_dir, subdir)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+
+def write_pickle(data, filename):
+    """pickle *data* to *filename* atomically."""
+    fd, tmpfilename = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                       prefix=".ctmp")
+    with os.fdopen(fd, "wb") as outf:
+        pickle.dump(data, outf)
+    os.rename(tmpfilename, filename)
+
+
+def import_function(module_name, function_name, modules={}):
+    """return *function_name* from *module_name*.
+
+    *module_name* can be the name of a module or the path of a python
+    file with or without the ``.py`` suffix. Modules that have already
+    been imported under a different name are re-used.
+    """
+    if module_name.endswith(".py"):
+        module_name = module_name[:-3]
+
+    if module_name not in modules:
+        module = None
+        location = os.path.dirname(module_name)
+        if location != "":
+            path = os.path.abspath(module_name) + ".py"
+            for m in list(sys.modules.values()):
+                if getattr(m, "__file__", None) == path:
+                    module = m
+                    break
+            if module is None and location not in sys.path:
+                sys.path.append(location)
+        if module is None:
+            module = importlib.import_module(os.path.basename(module_name))
+        modules[module_name] = module
+
+    module = modules[module_name]
+    try:
+        return getattr(module, function_name)
+    except AttributeError:
+        raise AttributeError(
+            "unknown function {}, available functions are: {}".format(
+                function_name,
+                ",".join([x for x in dir(module) if not x.startswith("_")])))
+
+
+def run_task(task):
+    """run a function call read from the spool directory.
+
+    Returns
+    -------
+    result : dict
+        Dictionary with the return value of the function (``result``)
+        or the formatted exception (``error``).
+    """
+    cwd = os.getcwd()
+    try:
+        function = import_function(task["module"], task["function"])
+        os.chdir(task.get("cwd", cwd))
+        result = {"result": function(*task["args"], **task["kwargs"]),
+                  "error": None}
+        # return values that can not be pickled are dropped
+        try:
+            pickle.dumps(result)
+        except Exception:
+            result["result"] = None
+    except Exception:
+        result = {"result": None,
+                  "error": traceback.format_exc()}
+    finally:
+        os.chdir(cwd)
+    return result
+
+
+def run_worker(spool_dir, idle_timeout=600, parent_pid=None):
+    """run function calls from *spool_dir* until idle.
+
+    Function calls are claimed by renaming them from the ``queue`` to
+    the ``running`` sub-directory, so that several workers can share a
+    spool directory.
+
+    Arguments
+    ---------
+    spool_dir : string
+        The spool directory.
+    idle_timeout : float
+        Exit after not receiving a function call for this many seconds.
+    parent_pid : int
+        Exit if the process *parent_pid* is no longer the parent of
+        this worker.
+
+    Returns
+    -------
+    num_tasks : int
+        Number of function calls run.
+    """
+    logger = get_logger()
+    setup_spool_directory(spool_dir)
+    worker_id = "{}_{}".format(socket.gethostname(), os.getpid())
+    heartbeat = os.path.join(spool_dir, "workers", worker_id)
+    queue_dir = os.path.join(spool_dir, "queue")
+    stop = threading.Event()
+
+    def beat():
+        while not stop.is_set():
+            with open(heartbeat, "a"):
+                os.utime(heartbeat, None)
+            stop.wait(HEARTBEAT_INTERVAL)
+
+    heartbeat_thread = threading.Thread(target=beat)
+    heartbeat_thread.daemon = True
+    heartbeat_thread.start()
+
+    logger.info("worker {} waiting for tasks in {}".format(
+        worker_id, spool_dir))
+    num_tasks = 0
+    last_task = time.time()
+    interval = 0.01
+    try:
+        while True:
+            if parent_pid is not None and os.getppid() != parent_pid:
+                break
+
+            claimed = None
+            for name in sorted(os.listdir(queue_dir)):
+                if name.startswith("."):
+                    continue
+                running = os.path.join(spool_dir, "running", name)
+                try:
+                    os.rename(os.path.join(queue_dir, name), running)
+                except OSError:
+                    # claimed by another worker
+                    continue
+                claimed = name
+                break
+
+            if claimed is None:
+                if time.time() - last_task > idle_timeout:
+                    break
+                time.sleep(interval)
+                interval = min(MAX_POLL_INTERVAL, interval * 2)
+                continue
+
+            with open(running, "rb") as inf:
+                task = pickle.load(inf)
+            logger.info("running {}.{}".format(
+                task["module"], task["function"]))
+            result = run_task(task)
+            write_pickle(result, os.path.join(spool_dir, "done", claimed))
+            os.unlink(running)
+
+            num_tasks += 1
+            last_task = time.time()
+            interval = 0.01
+    finally:
+        stop.set()
+        heartbeat_thread.join()
+        if os.path.exists(heartbeat):
+            os.unlink(heartbeat)
+
+    logger.info("worker {} finished after {} tasks".format(
+        worker_id, num_tasks))
+    return num_tasks
+
+
+class WorkerPool(object):
+    """a pool of warm python workers sharing a spool directory.
+
+    Arguments
+    ---------
+    spool_dir : string
+        The spool directory.
+    num_workers : int
+        Number of workers to start on the local host. Workers started
+        elsewhere on the same spool directory are used as well.
+    idle_timeout : float
+        Seconds after which idle local workers exit.
+    heartbeat_timeout : float
+        Seconds without a heartbeat after which a worker is assumed
+        to be dead.
+    """
+
+    def __init__(self, spool_dir, num_workers=0, idle_timeout=600,
+                 heartbeat_timeout=60):
+        self.spool_dir = os.path.abspath(spool_dir)
+        self.idle_timeout = idle_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.processes = []
+        setup_spool_directory(self.spool_dir)
+        self.start_workers(num_workers)
+
+    def start_workers(self, num_workers):
+        """start *num_workers* workers on the local host."""
+        for x in range(num_workers):
+            self.processes.append(subprocess.Popen(
+                # avoid "python -m" as the module is imported by
+                # cgatcore.pipeline before it is run
+                [sys.executable, "-c",
+                 "import sys; import cgatcore.pipeline.worker as w; "
+                 "sys.exit(w.main(sys.argv))",
+                 "--spool-dir={}".format(self.spool_dir),
+                 "--idle-timeout={}".format(self.idle_timeout),
+                 "--parent-pid={}".format(os.getpid()),
+                 "--log={}".format(os.path.join(
+                     self.spool_dir, "worker_{}.log".format(x)))],
+                cwd=get_params()["work_dir"],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                close_fds=True))
+
+    def has_live_workers(self):
+        """return True if any worker sent a heartbeat recently."""
+        workers_dir = os.path.join(self.spool_dir, "workers")
+        now = time.time()
+        for name in os.listdir(workers_dir):
+            try:
+                mtime = os.stat(os.path.join(workers_dir, name)).st_mtime
+            except OSError:
+                continue
+            if now - mtime < self.heartbeat_timeout:
+                return True
+        return any([p.poll() is None for p in self.processes])
+
+    def submit(self, module, function, args=(), kwargs=None, cwd=None):
+        """queue a function call.
+
+        Returns
+        -------
+        task_id : string
+            Identifier of the function call to pass to :meth:`wait`.
+        """
+        task_id = "{:.6f}_{}".format(time.time(), uuid.uuid4().hex)
+        write_pickle({"module": module,
+                      "function": function,
+                      "args": list(args),
+                      "kwargs": kwargs or {},
+                      "cwd": cwd or get_params()["work_dir"]},
+                     os.path.join(self.spool_dir, "queue", task_id))
+        return task_id
+
+    def wait(self, task_id):
+        """wait for a function call to finish and return its result.
+
+        Raises
+        ------
+        OSError
+            If the function raised an exception or if there are no
+            live workers to run the function.
+        """
+        done = os.path.join(self.spool_dir, "done", task_id)
+        interval = 0.01
+        last_check = time.time()
+        while not os.path.exists(done):
+            gevent.sleep(interval)
+            interval = min(MAX_POLL_INTERVAL, interval * 2)
+            if time.time() - last_check > HEARTBEAT_INTERVAL:
+                last_check = time.time()
+                if not self.has_live_workers():
+                    raise OSError(
+                        "no live workers for task {} in {}".format(
+                            task_id, self.spool_dir))
+
+        with open(done, "rb") as inf:
+            result = pickle.load(inf)
+        os.unlink(done)
+
+        if result["error"]:
+            raise OSError("task {} failed in worker:\n{}".format(
+                task_id, result["error"]))
+        return result["result"]
+
+    def call(self, module, function, args=(), kwargs=None, cwd=None):
+        """run a function call in a worker and return its result."""
+        return self.wait(self.submit(module, function, args, kwargs, cwd))
+
+    def close(self):
+        """stop workers started on the local host."""
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            process.wait()
+        self.processes = []
+
+
+def get_worker_pool():
+    """return the global pool of workers.
+
+    The pool is set up on first use from the configuration values
+    ``workers_local`` and ``workers_spool_dir``. Returns None if
+    neither is set.
+    """
+    global GLOBAL_WORKER_POOL
+
+    with GLOBAL_WORKER_POOL_LOCK:
+        if GLOBAL_WORKER_POOL is None:
+            params = get_params()
+            num_workers = params.get("workers_local", 0) or 0
+            spool_dir = params.get("workers_spool_dir", None)
+            if not num_workers and not spool_dir:
+                return None
+            if not spool_dir:
+                if not os.path.exists(params["shared_tmpdir"]):
+                    os.makedirs(params["shared_tmpdir"])
+                spool_dir = tempfile.mkdtemp(dir=params["shared_tmpdir"],
+                                             prefix="cgat_workers_")
+            GLOBAL_WORKER_POOL = WorkerPool(
+                spool_dir,
+                num_workers=num_workers,
+                idle_timeout=params.get("workers_idle_timeout", 600))
+    return GLOBAL_WORKER_POOL
+
+
+def close_worker_pool():
+    """stop the workers of the global pool."""
+    global GLOBAL_WORKER_POOL
+
+    with GLOBAL_WORKER_POOL_LOCK:
+        if GLOBAL_WORKER_POOL is not None:
+            GLOBAL_WORKER_POOL.close()
+            GLOBAL_WORKER_POOL = None
+
+
+def main(argv=sys.argv):
+
+    parser = E.ArgumentParser(description=__doc__)
+
+    parser.add_argument("--spool-dir", dest="spool_dir", type=str,
+                        help="spool directory to read function calls from")
+
+    parser.add_argument("--idle-timeout", dest="idle_timeout", type=float,
+                        help="exit after not receiving a function call "
+                        "for this many seconds")
+
+    parser.add_argument("--parent-pid", dest="parent_pid", type=int,
+                        help="exit if the parent process has finished")
+
+    parser.set_defaults(
+        spool_dir=None,
+        idle_timeout=600,
+        parent_pid=None)
+
+    args = E.start(parser, argv=argv)
+
+    if not args.spool_dir:
+        raise ValueError("please specify a spool directory")
+
+    # initialize defaults
+    get_parameters()
+
+    run_worker(args.spool_dir,
+               idle_timeout=args.idle_timeout,
+               parent_pid=args.parent_pid)
+
+    E.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
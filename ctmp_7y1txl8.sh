@@ -0,0 +1,15 @@
+#!/bin/bash -eu
+set -o pipefail
+source /root/package/cgat_job_preamble_v4_f1c13c48.sh
+cd /root/package/ctmppizsjgtb
+umask 002
+cgat_setup_tmpdir /tmp/root
+clean_all() { cgat_clean_tmpdir; cgat_info; }
+trap clean_all EXIT
+umask 002
+export MKL_NUM_THREADS=1
+export OPENBLAS_NUM_THREADS=1
+export OMP_NUM_THREADS=1
+echo here
+
+
@@ -73,3 +73,37 @@ class TestSlurmValueParsing(unittest.TestCase):
                     'AvePages': 580000,
                     'DerivedExitCode': '',
                     'MaxPages': 580000})
+
+
+class TestArrayTaskIds(unittest.TestCase):
+
+    def test_task_id_variable_is_set_for_each_queue_manager(self):
+        expected = {"sge": "SGE_TASK_ID",
+                    "slurm": "SLURM_ARRAY_TASK_ID",
+                    "torque": "PBS_ARRAYID",
+                    "pbspro": "PBS_ARRAY_INDEX"}
+        for queue_manager, variable in expected.items():
+            self.assertEqual(
+                cluster.get_queue_manager(queue_manager, None).task_id_variable,
+                variable)
+
+
+JobStatus = collections.namedtuple(
+    "JobStatus", ("exitStatus", "hasSignal", "terminatedSignal"))
+
+
+class TestMemoryErrorDetection(unittest.TestCase):
+
+    def test_killed_jobs_are_memory_errors(self):
+        c = cluster.get_queue_manager("sge", None)
+        self.assertTrue(c.is_memory_error(JobStatus(137, False, ""), []))
+        self.assertTrue(c.is_memory_error(JobStatus(0, True, "SIGKILL"), []))
+        self.assertFalse(c.is_memory_error(JobStatus(1, False, ""), []))
+
+    def test_jobs_reaching_requested_memory_are_memory_errors(self):
+        c = cluster.get_queue_manager("slurm", None)
+        usage = [cluster.JobInfo(1, {"MaxRSS": 1990000000})]
+        self.assertTrue(c.is_memory_error(
+            JobStatus(1, False, ""), usage, job_memory_bytes=2000000000))
+        self.assertFalse(c.is_memory_error(
+            JobStatus(1, False, ""), usage, job_memory_bytes=4000000000))
@@ -1,10 +1,16 @@
 """Test cases for the pipeline.execution module."""
 
 import shutil
+import collections
 import unittest
 import contextlib
+from unittest import mock
 import socket
+import subprocess
+import threading
+import time
 import os
+import gevent
 import cgatcore.pipeline as P
 import cgatcore.iotools as iotools
 
@@ -389,6 +395,426 @@ class TestExecutionRunLocal(unittest.TestCase):
             self.validate_benchmark_data(d, s)
 
 
+class TestExecutionRunLocalParallel(BaseTest):
+
+    def test_parallel_jobs_return_data_in_submission_order(self):
+        statements = ["sleep {}; echo {} > {}".format(
+            0.1 * (5 - x), x, os.path.join(self.work_dir, "out{}".format(x)))
+            for x in range(5)]
+
+        benchmark_data = P.run(statements,
+                               to_cluster=False,
+                               job_parallel=True,
+                               job_memory="10M")
+
+        self.assertEqual(len(benchmark_data), len(statements))
+        for d, s in zip(benchmark_data, statements):
+            self.assertEqual(d.statement, s)
+
+    def test_parallel_jobs_run_concurrently(self):
+        if os.cpu_count() < 2:
+            return
+        statements = ["sleep 1"] * 2
+        benchmark_data = P.run(statements,
+                               to_cluster=False,
+                               job_parallel=2,
+                               job_memory="10M")
+        first, second = benchmark_data
+        self.assertLess(second.start_time, first.end_time)
+
+    def test_parallel_jobs_are_limited_by_job_threads(self):
+        executor = P.LocalExecutor(job_parallel=True,
+                                   job_threads=os.cpu_count(),
+                                   job_memory="10M")
+        self.assertEqual(executor.get_parallel_jobs(10), 1)
+
+    def test_failing_parallel_job_raises(self):
+        self.assertRaises(OSError,
+                          P.run,
+                          ["ls", "unknown_command", "ls"],
+                          to_cluster=False,
+                          job_parallel=True,
+                          job_memory="10M")
+
+
+class TestExecutionRunLocalAccounting(BaseTest):
+
+    def test_memory_usage_is_recorded(self):
+        benchmark_data = P.run(
+            "python -c 'a = bytearray(100 * 1024 * 1024); a[:] = b\"1\" * len(a)'",
+            to_cluster=False)
+        d = benchmark_data[0]
+        # max_rss is in kilobytes
+        self.assertGreater(d.max_rss, 100 * 1024)
+        self.assertGreater(d.cpu_t, 0)
+        self.assertEqual(d.exit_status, 0)
+
+    @unittest.skipIf(not os.path.exists("/proc/self/stat"), "requires /proc")
+    def test_sampler_records_time_series(self):
+        benchmark_data = P.run(
+            "python -c 'import time; a = bytearray(100 * 1024 * 1024); "
+            "a[:] = b\"1\" * len(a); time.sleep(1)'",
+            to_cluster=False,
+            local_sampling_interval=0.1,
+            local_sampling_dir=self.work_dir)
+        d = benchmark_data[0]
+        self.assertGreater(d.sampled_max_rss, 100 * 1024)
+        self.assertGreater(d.sampled_mean_rss, 0)
+        self.assertLessEqual(d.sampled_mean_rss, d.sampled_max_rss)
+        self.assertGreaterEqual(d.sampled_max_threads, 1)
+
+        with open(d.sampled_metrics_file) as inf:
+            lines = inf.readlines()
+        self.assertEqual(lines[0].split(), list(P.ProcessTreeSampler.header))
+        self.assertGreater(len(lines), 3)
+
+    def test_no_timing_files_are_left(self):
+        P.run("ls", to_cluster=False)
+        self.assertEqual(
+            [x for x in os.listdir(P.get_params()["work_dir"])
+             if x.endswith(".times")], [])
+
+
+class TestAdmissionController(unittest.TestCase):
+
+    def test_job_waits_until_resources_are_released(self):
+        controller = P.AdmissionController(cores=4, memory=1000)
+        token = controller.acquire(3, 500)
+
+        admitted = threading.Event()
+
+        def job():
+            with controller.admit(2, 100):
+                admitted.set()
+
+        thread = threading.Thread(target=job)
+        thread.start()
+        self.assertFalse(admitted.wait(0.2))
+        controller.release(token)
+        self.assertTrue(admitted.wait(5))
+        thread.join()
+
+        stats = controller.get_statistics()
+        self.assertEqual(stats["admitted"], 2)
+        self.assertEqual(stats["queued"], 1)
+        self.assertEqual(stats["available_cores"], 4)
+        self.assertEqual(stats["available_memory"], 1000)
+        self.assertGreater(stats["max_wait_time"], 0)
+
+    def test_memory_is_limiting_resource(self):
+        controller = P.AdmissionController(cores=8, memory=1000)
+        controller.acquire(1, 600)
+        self.assertFalse(controller.fits(1, 600))
+        self.assertTrue(controller.fits(7, 400))
+
+    def test_oversized_requests_are_capped(self):
+        controller = P.AdmissionController(cores=2, memory=1000)
+        token = controller.acquire(16, 10000)
+        self.assertEqual(token, (2, 1000))
+        controller.release(token)
+        self.assertEqual(controller.available_cores, 2)
+
+
+class TestPollingInterval(unittest.TestCase):
+
+    def test_interval_increases_without_changes(self):
+        interval = 1
+        for x in range(20):
+            interval = P.get_polling_interval(interval, 0, 1, 30)
+        self.assertEqual(interval, 30)
+
+    def test_interval_decreases_with_changes(self):
+        self.assertEqual(P.get_polling_interval(30, 5, 1, 30), 15)
+        self.assertEqual(P.get_polling_interval(1.5, 1, 1, 30), 1)
+
+
+class TestJobScript(BaseTest):
+
+    def test_preamble_is_written_once(self):
+        filename = P.get_job_preamble(dir=self.work_dir)
+        self.assertEqual(P.get_job_preamble(dir=self.work_dir), filename)
+        self.assertEqual(
+            [x for x in os.listdir(self.work_dir)
+             if x.startswith("cgat_job_preamble")],
+            [os.path.basename(filename)])
+
+    def test_job_scripts_source_preamble(self):
+        executor = P.LocalExecutor(job_name="test",
+                                   shell_logfile="shell.log")
+        statement, job_path = executor.build_job_script("ls")
+        with open(job_path) as inf:
+            script = inf.read()
+        os.unlink(job_path)
+        self.assertIn("source {}".format(P.get_job_preamble()), script)
+        self.assertIn("cgat_log_shell", script)
+        self.assertTrue(script.rstrip().endswith("ls"))
+
+    def test_job_scripts_need_few_file_operations(self):
+        executor = P.LocalExecutor(job_name="test")
+        # write preamble outside of measured block
+        P.get_job_preamble()
+
+        counts = collections.Counter()
+
+        def count(name, f):
+            def _count(*args, **kwargs):
+                counts[name] += 1
+                return f(*args, **kwargs)
+            return _count
+
+        num_jobs = 20
+        job_paths = []
+        with contextlib.ExitStack() as stack:
+            for name in ("open", "stat", "mkdir", "rmdir",
+                         "unlink", "chmod", "fchmod"):
+                stack.enter_context(mock.patch.object(
+                    os, name, count(name, getattr(os, name))))
+            for x in range(num_jobs):
+                job_paths.append(executor.build_job_script("ls")[1])
+
+        for job_path in job_paths:
+            os.unlink(job_path)
+
+        # create and set permissions
+        self.assertEqual(sum(counts.values()), 2 * num_jobs)
+
+
+class TestStatementIndex(BaseTest):
+
+    statements = ["echo first",
+                  "echo 'second\nstatement' | cat",
+                  "echo \u00e9t\u00e9",
+                  "echo fourth"]
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        self.jobsfile = os.path.join(self.work_dir, "test.jobs")
+        self.indexfile = P.write_statement_index(self.statements, self.jobsfile)
+
+    def test_statements_can_be_read_from_index(self):
+        for task_id, statement in enumerate(self.statements, 1):
+            self.assertEqual(
+                P.read_statement_from_index(self.jobsfile, task_id),
+                statement)
+
+    def test_statements_can_be_read_from_index_in_job_script(self):
+        preamble = P.get_job_preamble(dir=self.work_dir)
+        for task_id, statement in enumerate(self.statements, 1):
+            output = subprocess.check_output(
+                ["bash", "-euc",
+                 "set -o pipefail; source {}; cgat_get_statement {} {} {}".format(
+                     preamble, self.jobsfile, self.indexfile, task_id)])
+            self.assertEqual(output.decode("utf-8"), statement)
+
+
+class TestStatementBundles(BaseTest):
+
+    def test_statements_are_packed_up_to_capacity(self):
+        bundles = P.pack_statements([10, 50, 30, 40, 20, 60], 60)
+        self.assertEqual(sorted(sum(bundles, [])), list(range(6)))
+        self.assertEqual(len(bundles), 4)
+        self.assertIn([5], bundles)
+
+    def test_long_statements_are_bundled_individually(self):
+        self.assertEqual(P.pack_statements([100, 100], 60), [[0], [1]])
+
+    def test_bundle_reports_status_per_statement(self):
+        statements = ["sleep 0.5",
+                      "sleep 0.5; exit 3",
+                      "sleep 0.5",
+                      "sleep 0.5 | false | true"]
+        jobsfile = os.path.join(self.work_dir, "test.jobs")
+        indexfile = P.write_statement_index(statements, jobsfile)
+        status_file = jobsfile + ".status"
+        preamble = P.get_job_preamble(dir=self.work_dir)
+
+        start = time.time()
+        subprocess.check_call(
+            ["bash", "-euc",
+             "set -o pipefail; source {}; cgat_setup_tmpdir {}; "
+             "cgat_run_bundle {} {} 1 4 2 {} '-eu -o pipefail'".format(
+                 preamble, self.work_dir, jobsfile, indexfile, status_file)])
+        self.assertLess(time.time() - start, 1.8)
+
+        with open(status_file) as inf:
+            status = P.parse_bundle_status(inf)
+        self.assertEqual(
+            dict([(x, y["exit_status"]) for x, y in status.items()]),
+            {1: 0, 2: 3, 3: 0, 4: 1})
+
+
+class TestMemoryEscalation(BaseTest):
+
+    def test_memory_is_increased_by_factor(self):
+        executor = P.LocalExecutor(job_memory="1G", job_threads=2)
+        self.assertTrue(executor.escalate_memory(2))
+        self.assertEqual(executor.job_memory, "2048M")
+        self.assertEqual(executor.job_total_memory, "4096M")
+
+    def test_memory_is_limited_to_maximum(self):
+        executor = P.LocalExecutor(job_memory="1G", job_threads=2)
+        self.assertTrue(executor.escalate_memory(4, memory_max="3G"))
+        self.assertEqual(executor.job_memory, "1536M")
+        self.assertFalse(executor.escalate_memory(4, memory_max="3G"))
+
+    def test_unlimited_memory_is_not_increased(self):
+        executor = P.LocalExecutor(job_memory="unlimited")
+        self.assertFalse(executor.escalate_memory(2))
+
+
+class TestStaging(BaseTest):
+
+    def test_files_are_staged_through_scratch(self):
+        infile = os.path.join(self.work_dir, "in.txt")
+        outfile = os.path.join(self.work_dir, "out.txt")
+        with open(infile, "w") as outf:
+            outf.write("staged\n")
+
+        P.run("cat {infile} > {outfile}; "
+              "echo {infile} >> {outfile}".format(**locals()),
+              to_cluster=False,
+              stage_in=[infile],
+              stage_out=outfile)
+
+        with open(outfile) as inf:
+            lines = inf.read().splitlines()
+        self.assertEqual(lines[0], "staged")
+        self.assertTrue(lines[1].endswith("/stage_in/0/in.txt"))
+        self.assertNotEqual(lines[1], infile)
+
+    def test_outputs_are_not_staged_out_on_failure(self):
+        outfile = os.path.join(self.work_dir, "out.txt")
+        self.assertRaises(OSError,
+                          P.run,
+                          "echo fail > {outfile}; false".format(**locals()),
+                          to_cluster=False,
+                          stage_out=[outfile])
+        self.assertFalse(os.path.exists(outfile))
+
+    def test_only_complete_paths_are_replaced(self):
+        executor = P.LocalExecutor(stage_in=["a.txt"])
+        statement, stage_in, stage_out = executor.stage_statement(
+            "cat a.txt data/a.txt a.txt.gz --input=a.txt")
+        self.assertEqual(
+            statement,
+            "cat $TMPDIR/stage_in/0/a.txt data/a.txt a.txt.gz "
+            "--input=$TMPDIR/stage_in/0/a.txt")
+        self.assertEqual(len(stage_in), 1)
+
+
+class TestEnvironmentSnapshot(BaseTest):
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        self.init = os.path.join(self.work_dir, "init.sh")
+        self.counter = os.path.join(self.work_dir, "sourced.txt")
+        with open(self.init, "w") as outf:
+            outf.write("echo sourced >> {}\n"
+                       "export CGAT_SNAPSHOT_TEST='a b'\n".format(
+                           self.counter))
+
+    def test_snapshot_is_captured_once(self):
+        for x in range(3):
+            outfile = os.path.join(self.work_dir, "out{}.txt".format(x))
+            P.run("echo $CGAT_SNAPSHOT_TEST > {}".format(outfile),
+                  to_cluster=False,
+                  environment_snapshot=True,
+                  environment_init=self.init)
+            with open(outfile) as inf:
+                self.assertEqual(inf.read(), "a b\n")
+
+        with open(self.counter) as inf:
+            self.assertEqual(len(inf.readlines()), 1)
+        os.unlink(P.get_environment_snapshot(init=self.init))
+
+    def test_snapshot_excludes_job_specific_variables(self):
+        filename = P.get_environment_snapshot(init=self.init,
+                                              dir=self.work_dir)
+        with open(filename) as inf:
+            names = [x.split("=")[0] for x in inf]
+        self.assertIn("export CGAT_SNAPSHOT_TEST", names)
+        self.assertNotIn("export PWD", names)
+        self.assertNotIn("export SHLVL", names)
+
+    def test_init_is_sourced_without_snapshot(self):
+        outfile = os.path.join(self.work_dir, "out.txt")
+        P.run("echo $CGAT_SNAPSHOT_TEST > {}".format(outfile),
+              to_cluster=False,
+              environment_init=self.init)
+        with open(outfile) as inf:
+            self.assertEqual(inf.read(), "a b\n")
+
+
+class TestSubmissionThrottle(unittest.TestCase):
+
+    def test_submissions_are_rate_limited_after_burst(self):
+        throttle = P.SubmissionThrottle(rate=100, burst=5, max_jobs=1000)
+        start = time.time()
+        for x in range(25):
+            throttle.acquire()
+        # 5 submissions from the burst, 20 at 100 per second
+        self.assertGreaterEqual(time.time() - start, 0.18)
+        self.assertEqual(throttle.num_submitted, 25)
+
+    def test_jobs_in_flight_never_exceed_cap(self):
+        throttle = P.SubmissionThrottle(rate=1000, burst=100, max_jobs=3)
+        running = []
+
+        def submit():
+            n = throttle.acquire()
+            running.append(throttle.in_flight)
+            gevent.sleep(0.02)
+            throttle.release(n)
+
+        gevent.joinall([gevent.spawn(submit) for x in range(10)],
+                       raise_error=True)
+        self.assertEqual(len(running), 10)
+        self.assertEqual(max(running), 3)
+        self.assertEqual(throttle.in_flight, 0)
+
+    def test_large_requests_are_capped(self):
+        throttle = P.SubmissionThrottle(rate=1000, burst=100, max_jobs=3)
+        self.assertEqual(throttle.acquire(1000), 3)
+
+
+class CountingSession(object):
+    """a DRMAA session with jobs finishing after a fixed number of
+    status queries."""
+
+    def __init__(self, num_polls):
+        self.num_polls = num_polls
+        self.queries = collections.Counter()
+
+    def jobStatus(self, job_id):
+        import drmaa
+        self.queries[job_id] += 1
+        if self.queries[job_id] >= self.num_polls:
+            return drmaa.JobState.DONE
+        return drmaa.JobState.RUNNING
+
+
+@unittest.skipIf(not P.HAS_DRMAA, "requires drmaa")
+class TestJobMonitor(unittest.TestCase):
+
+    def test_single_monitor_serves_concurrent_waits(self):
+        session = CountingSession(num_polls=3)
+        monitor = P.JobMonitor(session,
+                               min_interval=0.01,
+                               max_interval_queued=0.01,
+                               max_interval_running=0.01)
+
+        job_ids = [str(x) for x in range(100)]
+        waits = [gevent.spawn(monitor.wait, job_ids[x:x + 10])
+                 for x in range(0, len(job_ids), 10)]
+        gevent.joinall(waits, raise_error=True)
+        monitor.stop()
+
+        self.assertEqual(len(monitor.jobs), 0)
+        # polling cycles are shared between all waits
+        self.assertEqual(monitor.num_cycles, 3)
+        self.assertEqual(monitor.num_queries, 3 * len(job_ids))
+
+
 @unittest.skipIf(QUEUE_MANAGER is None, "no cluster configured for testing")
 class TestExecutionRunCluster(TestExecutionRunLocal):
     to_cluster = True
@@ -0,0 +1,54 @@
+"""Test cases for the pipeline.files module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import cgatcore.pipeline as P
+
+
+class TestStageFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.dest_dir = tempfile.mkdtemp()
+        self.files = {"a.txt": b"a" * 1000,
+                      os.path.join("sub", "b.txt"): b"b" * 100000,
+                      os.path.join("sub", "deeper", "c.txt"): b""}
+        for fn, data in self.files.items():
+            path = os.path.join(self.src_dir, fn)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as outf:
+                outf.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+        shutil.rmtree(self.dest_dir)
+
+    def check_destination(self):
+        for fn, data in self.files.items():
+            with open(os.path.join(self.dest_dir, fn), "rb") as inf:
+                self.assertEqual(inf.read(), data)
+
+    def test_files_are_moved_keeping_directory_structure(self):
+        stats = P.stage_files(self.src_dir, self.dest_dir)
+        self.check_destination()
+        self.assertEqual(stats["renamed"] + stats["copied"], len(self.files))
+        for fn in self.files:
+            self.assertFalse(os.path.exists(os.path.join(self.src_dir, fn)))
+
+    def test_files_are_copied_and_verified(self):
+        stats = P.stage_files(self.src_dir, self.dest_dir, move=False,
+                              threads=2)
+        self.check_destination()
+        self.assertEqual(stats["copied"], len(self.files))
+        self.assertEqual(stats["bytes"], sum(map(len, self.files.values())))
+        for fn in self.files:
+            self.assertTrue(os.path.exists(os.path.join(self.src_dir, fn)))
+        self.assertFalse([x for x in os.listdir(self.dest_dir)
+                          if x.endswith(".staging")])
+
+
+if __name__ == "__main__":
+    unittest.main()
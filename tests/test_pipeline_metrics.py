@@ -0,0 +1,101 @@
+"""Test cases for the pipeline.metrics module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import cgatcore.pipeline as P
+import cgatcore.pipeline.metrics as metrics
+
+
+class TestStatementFingerprint(unittest.TestCase):
+
+    def test_fingerprint_ignores_filenames_and_numbers(self):
+        self.assertEqual(
+            P.get_statement_fingerprint(
+                "bwa mem -t 4 ref.fa sample1.fastq.gz > /data/sample1.bam"),
+            P.get_statement_fingerprint(
+                "bwa  mem -t 8 ref.fa sample2.fastq.gz > /data/sample2.bam"))
+
+    def test_fingerprint_differs_between_commands(self):
+        self.assertNotEqual(
+            P.get_statement_fingerprint("bwa mem ref.fa in.fastq.gz"),
+            P.get_statement_fingerprint("bowtie2 -x ref in.fastq.gz"))
+
+
+class TestMetricsStore(unittest.TestCase):
+
+    def setUp(self):
+        P.get_parameters()
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = P.MetricsStore(os.path.join(self.tmpdir, "metrics.db"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def add_job(self, statement, max_rss, wall_t, cpu_t, exit_status=0):
+        self.store.add([{"task": "task1",
+                         "statement": statement,
+                         "max_rss": max_rss,
+                         "wall_t": wall_t,
+                         "cpu_t": cpu_t,
+                         "exit_status": exit_status}],
+                       max_rss_unit=1024)
+
+    def test_usage_is_none_without_history(self):
+        self.assertEqual(self.store.get_usage("task1", ["ls"]), None)
+
+    def test_usage_is_peak_of_successful_jobs(self):
+        self.add_job("sort a.txt > a.sorted", 1024, 10, 10)
+        self.add_job("sort b.txt > b.sorted", 2048, 20, 40)
+        self.add_job("sort c.txt > c.sorted", 4096, 100, 100, exit_status=1)
+        usage = self.store.get_usage("task1", ["sort d.txt > d.sorted"])
+        self.assertEqual(usage["jobs"], 2)
+        self.assertEqual(usage["max_rss_bytes"], 2048 * 1024)
+        self.assertEqual(usage["wall_t"], 20)
+        self.assertEqual(usage["cores"], 2)
+
+    def test_executor_is_sized_from_history(self):
+        self.add_job("sort a.txt > a.sorted", 3 * 2 ** 20, 100, 100)
+        store = metrics.GLOBAL_METRICS_STORE
+        metrics.GLOBAL_METRICS_STORE = self.store
+        try:
+            executor = P.LocalExecutor(
+                task_name="task1",
+                job_threads=4,
+                job_memory="32G",
+                cluster={"queue": "long.q"},
+                metrics_queues={"short.q": 3600, "long.q": 86400})
+            executor.size_from_metrics(["sort b.txt > b.sorted"])
+        finally:
+            metrics.GLOBAL_METRICS_STORE = store
+
+        self.assertEqual(executor.job_threads, 2)
+        # 3G * 1.5 margin / 2 threads
+        self.assertEqual(executor.job_memory, "2304M")
+        self.assertEqual(executor.options["cluster"]["queue"], "short.q")
+
+
+class TestJobResources(unittest.TestCase):
+
+    usage = {"jobs": 1, "max_rss_bytes": 2 ** 30, "wall_t": 7200, "cores": 1}
+
+    def test_queue_is_selected_by_runtime(self):
+        resources = P.get_job_resources(
+            self.usage, 1,
+            queues={"short.q": 3600, "medium.q": 14400, "long.q": 86400})
+        self.assertEqual(resources["job_queue"], "medium.q")
+
+    def test_longest_queue_is_used_if_none_fits(self):
+        resources = P.get_job_resources(
+            self.usage, 1, queues={"short.q": 3600})
+        self.assertEqual(resources["job_queue"], "short.q")
+
+    def test_threads_are_not_increased(self):
+        usage = dict(self.usage, cores=8)
+        self.assertEqual(P.get_job_resources(usage, 2)["job_threads"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
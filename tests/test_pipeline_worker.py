@@ -0,0 +1,101 @@
+"""Test cases for the pipeline.worker module."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import cgatcore.pipeline as P
+import cgatcore.pipeline.worker as worker
+
+MODULE = '''
+def copy(infile, outfile):
+    with open(infile) as inf, open(outfile, "w") as outf:
+        outf.write(inf.read())
+'''
+
+
+class TestRunWorker(unittest.TestCase):
+
+    def setUp(self):
+        P.get_parameters()
+        self.spool_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def test_worker_runs_queued_tasks_and_exits_when_idle(self):
+        pool = worker.WorkerPool(self.spool_dir)
+        task_ids = [pool.submit("os.path", "join", args=["a", str(x)])
+                    for x in range(3)]
+        self.assertEqual(worker.run_worker(self.spool_dir, idle_timeout=0.1),
+                         3)
+        self.assertEqual([pool.wait(x) for x in task_ids],
+                         ["a/0", "a/1", "a/2"])
+        self.assertEqual(os.listdir(os.path.join(self.spool_dir, "workers")),
+                         [])
+
+    def test_errors_are_raised_in_caller(self):
+        pool = worker.WorkerPool(self.spool_dir)
+        task_id = pool.submit("os.path", "no_such_function")
+        worker.run_worker(self.spool_dir, idle_timeout=0.1)
+        self.assertRaises(OSError, pool.wait, task_id)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        P.get_parameters()
+        self.spool_dir = tempfile.mkdtemp()
+        self.pool = worker.WorkerPool(self.spool_dir, num_workers=2,
+                                 idle_timeout=30)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.spool_dir)
+
+    def test_workers_are_reused(self):
+        pids = set([self.pool.call("os", "getpid") for x in range(10)])
+        self.assertTrue(len(pids) <= 2)
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_calls_from_several_threads(self):
+        results = {}
+
+        def call(x):
+            results[x] = self.pool.call("os.path", "join",
+                                        args=["a", str(x)])
+
+        threads = [threading.Thread(target=call, args=(x,))
+                   for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict([(x, "a/{}".format(x))
+                                        for x in range(8)]))
+
+    def test_submit_runs_function_in_worker(self):
+        work_dir = tempfile.mkdtemp()
+        module = os.path.join(work_dir, "worker_test_module.py")
+        with open(module, "w") as outf:
+            outf.write(MODULE)
+        infile = os.path.join(work_dir, "in.txt")
+        outfile = os.path.join(work_dir, "out.txt")
+        with open(infile, "w") as outf:
+            outf.write("data\n")
+
+        pool = worker.GLOBAL_WORKER_POOL
+        worker.GLOBAL_WORKER_POOL = self.pool
+        try:
+            P.submit(module, "copy", infiles=infile, outfiles=outfile)
+        finally:
+            worker.GLOBAL_WORKER_POOL = pool
+
+        with open(outfile) as inf:
+            self.assertEqual(inf.read(), "data\n")
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()